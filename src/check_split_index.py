@@ -0,0 +1,139 @@
+import os
+import sys
+import collections
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import src.split_index as splitIndexSrc
+
+import numpy as np
+
+# compares split_index against the list based split code it replaced, on synthetic labels
+# an index mix-up there would silently move validation samples into training
+
+def old_extract_subclasses(subclasses, Y_coarse):
+    indices = []
+    for sc in subclasses :
+        indices += [i for i in range(len(Y_coarse)) if Y_coarse[i] == sc]
+    return indices
+
+def old_cifar_validation_set(trainFineY, trainIndices, trainValSplit):
+    fineY = [trainFineY[i] for i in trainIndices]
+    uniqueClasses = set(fineY)
+    dist = {k:[trainIndices[i] for i,y in enumerate(fineY) if y == k] for k in uniqueClasses}
+    numTrain = int(trainValSplit * len(next(iter(dist.values()))))
+    trainIndices = []
+    valIndices = []
+    [trainIndices.extend(v[:numTrain]) for v in dist.values()]
+    [valIndices.extend(v[numTrain:]) for v in dist.values()]
+    return trainIndices, valIndices
+
+def old_imagenet_validation_set(targets, classes, p):
+    trainIndicesByClass = {k:[] for k in classes}
+    [trainIndicesByClass[x].append(i) for i,x in enumerate(targets) if x in classes]
+    tI = []
+    vI = []
+    for k,v in trainIndicesByClass.items():
+        tI += v[:int(len(v)*p)]
+        vI += v[int(len(v)*p):]
+    return tI, vI
+
+def class_counts(labels, indices):
+    return collections.Counter(int(labels[i]) for i in indices)
+
+def check_subset(labels, classes):
+    new = splitIndexSrc.subset(labels, classes)
+    old = old_extract_subclasses(classes, labels.tolist())
+    assert new.dtype == splitIndexSrc.INDEX_DTYPE
+    assert sorted(new.tolist()) == sorted(old), 'subset differs from the per class loop'
+    assert len(set(new.tolist())) == len(new), 'subset holds duplicates'
+    return new
+
+def check_split(new, old, indices, labels):
+    train, val = new
+    oldTrain, oldVal = old
+    assert train.dtype == splitIndexSrc.INDEX_DTYPE and val.dtype == splitIndexSrc.INDEX_DTYPE
+    assert sorted(train.tolist()) == sorted(oldTrain), 'train split differs from the per class loop'
+    assert sorted(val.tolist()) == sorted(oldVal), 'val split differs from the per class loop'
+    assert set(train.tolist()).isdisjoint(val.tolist()), 'train and val splits overlap'
+    assert sorted(train.tolist() + val.tolist()) == sorted(int(i) for i in indices), 'splits do not cover the subset'
+    assert class_counts(labels, train) == class_counts(labels, oldTrain), 'per class train counts differ'
+    assert class_counts(labels, val) == class_counts(labels, oldVal), 'per class val counts differ'
+
+def check_buckets(labels, indices):
+    classes, buckets = splitIndexSrc.class_buckets(labels, indices)
+    old = {}
+    for i in indices:
+        old.setdefault(int(labels[i]), []).append(int(i))
+    assert sorted(old.keys()) == classes.tolist(), 'bucket classes differ'
+    for c, bucket in zip(classes, buckets):
+        assert bucket.tolist() == old[int(c)], 'bucket of class {} differs'.format(c)
+
+def check_cifar(rng):
+    # balanced like CIFAR-100, 100 fine classes nested in 20 coarse ones
+    fine = rng.permutation(np.repeat(np.arange(100), 500))
+    coarse = fine // 5
+    for p in (0.8, 0.9, 0.55):
+        for classes in ([3], [7, 1, 12], list(range(20))):
+            subset = check_subset(coarse, classes)
+            new = splitIndexSrc.stratified_split(fine, subset, p)
+            old = old_cifar_validation_set(fine.tolist(), old_extract_subclasses(classes, coarse.tolist()), p)
+            check_split(new, old, subset, fine)
+            check_buckets(coarse, new[0])
+            check_buckets(fine, subset)
+
+def check_imagenet(rng):
+    # unbalanced classes, including empty ones among the selected
+    targets = rng.randint(0, 60, 30000)
+    targets[targets == 13] = 14
+    for p in (0.8, 0.5):
+        for classes in ([0, 5, 13, 59], list(range(0, 60, 3))):
+            subset = check_subset(targets, classes)
+            new = splitIndexSrc.stratified_split(targets, subset, p)
+            old = old_imagenet_validation_set(targets.tolist(), classes, p)
+            check_split(new, old, subset, targets)
+    assert len(splitIndexSrc.subset(targets, [])) == 0
+
+def check_round_trip(rng, tmp):
+    import csv
+    import json
+
+    # single row CSV files as written for the train, val and test splits
+    indices = rng.permutation(5000)[:3000]
+    csvPath = os.path.join(tmp, 'trainIndices_0_8.csv')
+    with open(csvPath, 'w') as csvFile:
+        csv.writer(csvFile, delimiter=',').writerow(indices.tolist())
+    for attempt in range(2):
+        loaded = splitIndexSrc.load_indices(csvPath)
+        assert loaded.dtype == splitIndexSrc.INDEX_DTYPE
+        assert loaded.tolist() == indices.tolist(), 'CSV indices changed by the .npy conversion'
+    assert os.path.isfile(splitIndexSrc.binary_path(csvPath))
+
+    # per coarse class JSON files, converted and written directly
+    names = ['class{}'.format(i) for i in range(20)]
+    buckets = {name: rng.permutation(10000)[:rng.randint(0, 200)].tolist() for name in names}
+    jsonPath = os.path.join(tmp, 'coarseTrainIndices_0_8.json')
+    with open(jsonPath, 'w') as jsonFile:
+        json.dump(buckets, jsonFile)
+    writtenPath = os.path.join(tmp, 'coarseValIndices_0_8.json')
+    splitIndexSrc.save_class_indices(writtenPath, {name: np.asarray(b) for name, b in buckets.items()})
+
+    for path in (jsonPath, writtenPath):
+        for selected in (['class3'], ['class12', 'class0', 'class7'], names):
+            loaded = splitIndexSrc.load_class_indices(path, selected)
+            expected = sum((buckets[name] for name in selected), [])
+            assert loaded.tolist() == expected, 'class indices changed by the .npy conversion'
+        assert len(splitIndexSrc.load_class_indices(path, [])) == 0
+
+def main():
+    import tempfile
+
+    rng = np.random.RandomState(0)
+    check_cifar(rng)
+    check_imagenet(rng)
+    print('split_index: splits match the per class loops')
+    with tempfile.TemporaryDirectory() as tmp:
+        check_round_trip(rng, tmp)
+    print('split_index: CSV and JSON indices survive the .npy conversion')
+
+if __name__ == '__main__':
+    main()
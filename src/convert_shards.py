@@ -0,0 +1,25 @@
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import src.shard_dataset as shardDatasetSrc
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Convert an ImageFolder into shards of pre-resized images for Imagenet_Shards')
+    parser.add_argument('--folder', required=True, type=str, help='ImageFolder root, e.g. <imagenet>/train')
+    parser.add_argument('--out', required=True, type=str, help='output directory, e.g. <shards>/train')
+    parser.add_argument('--short-side', default=256, type=int, help='images are resized so that their short side is at most this')
+    parser.add_argument('--samples-per-shard', default=4096, type=int, help='images per shard file')
+    parser.add_argument('--quality', default=90, type=int, help='JPEG quality of the re-encoded images')
+    parser.add_argument('--workers', default=8, type=int, help='shards written in parallel')
+    parser.add_argument('--seed', default=0, type=int, help='seed of the global order the images are written in')
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_command_line_args()
+    shardDatasetSrc.convert(args.folder, args.out, args.short_side, args.samples_per_shard, args.quality, args.workers, args.seed)
+
+if __name__ == '__main__':
+    main()
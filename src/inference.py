@@ -13,7 +13,8 @@ class Inferer(object):
         losses = utils.AverageMeter()
         top1 = utils.AverageMeter()
         top5 = utils.AverageMeter()
-        for batch_idx, batch in tqdm(enumerate(test_loader), total=len(test_loader), desc='inference', leave=False):
+        bar = utils.progress(enumerate(test_loader), params, total=len(test_loader), desc='inference', leave=False)
+        for batch_idx, batch in bar:
             # move inputs and targets to GPU
             inputs, targets = batch[0], batch[1]
             if type(batch[0]) == str:
@@ -30,9 +31,10 @@ class Inferer(object):
 
             prec1, prec5 = utils.accuracy(outputs.data, targets.data)
 
-            losses.update(loss.item())
-            top1.update(prec1.item())
-            top5.update(prec5.item())
+            losses.update(loss)
+            top1.update(prec1)
+            top5.update(prec5)
+            utils.log_progress(bar, batch_idx, params, losses, top1, top5)
 
         if verbose:
             tqdm.write('Loss: {}, Top1: {}, Top5: {}'.format(losses.avg, top1.avg, top5.avg))
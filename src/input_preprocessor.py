@@ -8,12 +8,13 @@ from PIL import Image
 
 import os
 import sys
-import csv
-import json
 import time
 import pickle
 import pandas as pd
 
+import src.split_index as splitIndexSrc
+import src.tensor_dataset as tensorDatasetSrc
+
 from robustness import datasets as customDataset
 from robustness.tools.imagenet_helpers import common_superclass_wnid, ImageNetHierarchy
 
@@ -48,12 +49,7 @@ class Preproc(object):
     
     def extract_subclasses(self, subclasses, Y_coarse) : 
         #{{{
-        indices = []
-        
-        for sc in subclasses :
-            indices += [i for i in range(len(Y_coarse)) if Y_coarse[i] == sc]
-        
-        return indices
+        return splitIndexSrc.subset(Y_coarse, subclasses)
         #}}}
     
     def create_subclass_dataset(self, dataset, coarseClasses=[]): 
@@ -97,9 +93,9 @@ class Preproc(object):
                         fileNames = imgs['filenames']
                         fineY = imgs['labels']
                     else:
-                        np.append(X, imgs['data'])
-                        np.append(fileNames, imgs['filenames'])
-                        np.append(fineY, imgs['labels'])
+                        X = np.append(X, imgs['data'], axis=0)
+                        fileNames = fileNames + imgs['filenames']
+                        fineY = fineY + imgs['labels']
             else:
                 with open(os.path.join(dataLoc, "test_batch"), mode='rb') as data : 
                     imgs = pickle.load(data, encoding='latin1')        
@@ -164,18 +160,28 @@ class Preproc(object):
             self.metaData, self.fineYNames, self.coarseYNames = self.extract_cifar_meta(data_loc, 10)
         #}}}
 
+    def load_label_index(self, dataset, data_loc):
+        #{{{
+        # fine and coarse labels of both splits, cached next to the data so that the image batches
+        # do not have to be unpickled or transformed just to read the labels
+        folder, classes = ('cifar-100-python', 100) if dataset == 'cifar100' else ('cifar-10-batches-py', 10)
+        indexFile = os.path.join(data_loc, folder, 'labelIndex.npz')
+
+        if not os.path.isfile(indexFile):
+            print('Creating label index {}'.format(indexFile))
+            self.extract_cifar_data(dataset, data_loc)
+            np.savez(indexFile, trainFineY=np.asarray(self.trainFineY, dtype=np.int16), trainCoarseY=np.asarray(self.trainCoarseY, dtype=np.int16), \
+                                testFineY=np.asarray(self.testFineY, dtype=np.int16), testCoarseY=np.asarray(self.testCoarseY, dtype=np.int16))
+        else:
+            with np.load(indexFile) as index:
+                self.trainFineY, self.trainCoarseY = index['trainFineY'], index['trainCoarseY']
+                self.testFineY, self.testCoarseY = index['testFineY'], index['testCoarseY']
+            self.metaData, self.fineYNames, self.coarseYNames = self.extract_cifar_meta(os.path.join(data_loc, folder), classes)
+        #}}}
+
     def get_validation_set(self, params, trainIndices):
         #{{{
-        fineY = [self.trainFineY[i] for i in trainIndices]
-        uniqueClasses = set(fineY)
-        dist = {k:[trainIndices[i] for i,y in enumerate(fineY) if y == k] for k in uniqueClasses}
-        numTrain = int(params.trainValSplit * len(next(iter(dist.values()))))
-        trainIndices = []
-        valIndices = []
-        [trainIndices.extend(v[:numTrain]) for v in dist.values()]
-        [valIndices.extend(v[numTrain:]) for v in dist.values()]
-
-        return trainIndices, valIndices
+        return splitIndexSrc.stratified_split(self.trainFineY, trainIndices, params.trainValSplit)
         #}}}
 
     def get_loaders(self, params, trainSet, testSet, trainIndices=None, testIndices=None):
@@ -195,37 +201,24 @@ class Preproc(object):
                 trainIndFile = os.path.join(params.data_location, 'cifar-100-python', trainIndFileName)
                 valIndFile = os.path.join(params.data_location, 'cifar-100-python', valIndFileName)
                 
-                if not os.path.isfile(trainIndFile) or not os.path.isfile(valIndFile):
+                if not splitIndexSrc.has_class_indices(trainIndFile) or not splitIndexSrc.has_class_indices(valIndFile):
                     #{{{
-                    print('Creating JSON with per coarse class train and val indices')
-                    ccTrain = {cc:[] for cc in self.coarseYNames}
-                    ccVal = {cc:[] for cc in self.coarseYNames}
-                    for sc in self.coarseYNames:
-                        train_indices, test_indices = self.create_subclass_dataset(params.dataset, [sc]) 
-                        train, val = self.get_validation_set(params, train_indices)
-                        ccTrain[sc] = train
-                        ccVal[sc] = val
-                    with open(trainIndFile, 'w') as tFile: 
-                        json.dump(ccTrain, tFile)
-                    with open(valIndFile, 'w') as vFile:
-                        json.dump(ccVal, vFile)
+                    print('Creating per coarse class train and val indices')
+                    # fine classes nest in the coarse ones, so one split over all of them is bucketed by coarse class
+                    train, val = self.get_validation_set(params, np.arange(len(self.trainFineY)))
+                    trainClasses, trainBuckets = splitIndexSrc.class_buckets(self.trainCoarseY, train)
+                    valClasses, valBuckets = splitIndexSrc.class_buckets(self.trainCoarseY, val)
+                    splitIndexSrc.save_class_indices(trainIndFile, {self.coarseYNames[c]:b for c, b in zip(trainClasses, trainBuckets)})
+                    splitIndexSrc.save_class_indices(valIndFile, {self.coarseYNames[c]:b for c, b in zip(valClasses, valBuckets)})
                     #}}}
                 
-                else:
-                    with open(trainIndFile, 'r') as tF:
-                        ccTrainIndices = json.load(tF)
-                    with open(valIndFile, 'r') as vF:
-                        ccValIndices = json.load(vF)
+                # indices in the binary index next to the JSON files, which are converted if only they exist
+                trainIndices = splitIndexSrc.load_class_indices(trainIndFile, params.sub_classes)
+                valIndices = splitIndexSrc.load_class_indices(valIndFile, params.sub_classes)
+                self.trainIndices = trainIndices 
+                self.valIndices = valIndices
                     
-                    trainIndices = []
-                    valIndices = []
-                    for cc in params.sub_classes:
-                        trainIndices += ccTrainIndices[cc]
-                        valIndices += ccValIndices[cc]
-                    self.trainIndices = trainIndices 
-                    self.valIndices = valIndices
-                        
-                    _, testIndices = self.create_subclass_dataset(params.dataset, params.sub_classes) 
+                _, testIndices = self.create_subclass_dataset(params.dataset, params.sub_classes) 
                 #}}}
             else:
                 raise ValueError('Sub Class Extraction not implemented for {}'.format(params.dataset))
@@ -248,17 +241,11 @@ class Preproc(object):
                 trainIndFile = os.path.join(params.data_location, trainIndFileName)
                 valIndFile = os.path.join(params.data_location, valIndFileName)
 
-            with open(trainIndFile, 'r') as csvFile:
-                csvReader = csv.reader(csvFile, delimiter=',')
-                trainIndices = next(csvReader)
-                trainIndices = [int(x) for x in trainIndices]
-                self.trainIndices = trainIndices
-            
-            with open(valIndFile, 'r') as csvFile:
-                csvReader = csv.reader(csvFile, delimiter=',')
-                valIndices = next(csvReader)
-                valIndices = [int(x) for x in valIndices]
-                self.valIndices = valIndices
+            # memory mapped from the binary index next to the CSV files, which are converted on first use
+            trainIndices = splitIndexSrc.load_indices(trainIndFile)
+            self.trainIndices = trainIndices
+            valIndices = splitIndexSrc.load_indices(valIndFile)
+            self.valIndices = valIndices
         #}}}
         
         else:
@@ -267,6 +254,12 @@ class Preproc(object):
         
         self.testIndices = testIndices
 
+        if isinstance(trainSet, tensorDatasetSrc.CIFARTensorSet):
+            trainLoader = trainSet.loader(trainIndices, params.train_batch, params.workers)
+            valLoader = trainSet.loader(valIndices, params.test_batch, params.workers)
+            testLoader = testSet.loader(testIndices, params.test_batch, params.workers)
+            return trainLoader, valLoader, testLoader
+
         trainLoader = torch.utils.data.DataLoader(trainSet, batch_size=params.train_batch, num_workers=params.workers, sampler = torch.utils.data.sampler.SubsetRandomSampler(trainIndices))
         valLoader = torch.utils.data.DataLoader(trainSet, batch_size=params.test_batch, num_workers=params.workers, sampler = torch.utils.data.sampler.SubsetRandomSampler(valIndices))
         testLoader = torch.utils.data.DataLoader(testSet, batch_size=params.test_batch, num_workers=params.workers, sampler = torch.utils.data.sampler.SubsetRandomSampler(testIndices))
@@ -315,7 +308,12 @@ class Preproc(object):
             data_loader = torchvision.datasets.CIFAR100
         elif cifarIndex == 10:
             data_loader = torchvision.datasets.CIFAR10
-        self.extract_cifar_data(params.dataset, data_loc)
+
+        # the tensor backends need the decoded images, the torchvision one only the labels
+        if params.cifarBackend == 'Torchvision':
+            self.load_label_index(params.dataset, data_loc)
+        else:
+            self.extract_cifar_data(params.dataset, data_loc)
 
         if params.sub_classes != []: 
             print('Generating subset of dataset with classes %s' % params.sub_classes)
@@ -323,6 +321,13 @@ class Preproc(object):
         else:
             train_indices = None
             test_indices = None
+
+        # the splits decoded above are kept as uint8 tensors and augmented a batch at a time
+        if params.cifarBackend != 'Torchvision':
+            device = 'cuda:' + str(params.gpuList[0]) if params.cifarBackend == 'TensorGPU' else 'cpu'
+            train_set = tensorDatasetSrc.CIFARTensorSet(self.trainX, self.trainFineY, augment=True, device=device)
+            test_set = tensorDatasetSrc.CIFARTensorSet(self.testX, self.testFineY, augment=False, device=device)
+            return self.get_loaders(params, train_set, test_set, train_indices, test_indices)
         
         train_transform = torchvision.transforms.Compose([
             torchvision.transforms.RandomCrop(32, padding=4),
@@ -337,8 +342,6 @@ class Preproc(object):
         ])
         
         train_set = data_loader(root=data_loc, train=True, download=False, transform=train_transform)
-        if cifarIndex == 10:
-            self.trainFineY = [targets for index, (inputs, targets) in enumerate(train_set)]
         test_set = data_loader(root=data_loc, train=False, download=False, transform=test_transform)
         train_loader, val_loader, test_loader = self.get_loaders(params, train_set, test_set, train_indices, test_indices)
         
@@ -476,33 +479,17 @@ class CIFAR(object):
     
     def create_subclass_dataset(self, coarseClasses): 
     #{{{
-        def extract_subclasses(subclasses, Y_coarse) : 
-        #{{{
-            indices = []
-            for sc in subclasses :
-                indices += [i for i in range(len(Y_coarse)) if Y_coarse[i] == sc]
-            return indices
-        #}}}
-        
         # extract the images for those classes
         YLabels = [self.coarseYNames.index(y) for y in coarseClasses] 
-        trainIndices = extract_subclasses(YLabels, self.trainCoarseY)
-        testIndices = extract_subclasses(YLabels, self.testCoarseY)
+        trainIndices = splitIndexSrc.subset(self.trainCoarseY, YLabels)
+        testIndices = splitIndexSrc.subset(self.testCoarseY, YLabels)
         
         return (trainIndices, testIndices)
     #}}}
     
     def get_validation_set(self, trainIndices):
     #{{{
-        fineY = [self.trainFineY[i] for i in trainIndices]
-        uniqueClasses = set(fineY)
-        dist = {k:[trainIndices[i] for i,y in enumerate(fineY) if y == k] for k in uniqueClasses}
-        numTrain = int(self.params.trainValSplit * len(next(iter(dist.values()))))
-        trainIndices = []
-        valIndices = []
-        [trainIndices.extend(v[:numTrain]) for v in dist.values()]
-        [valIndices.extend(v[numTrain:]) for v in dist.values()]
-        return trainIndices, valIndices
+        return splitIndexSrc.stratified_split(self.trainFineY, trainIndices, self.params.trainValSplit)
     #}}}
     
     def create_loaders(self, trainSet, testSet, trainIndices=None, testIndices=None):
@@ -522,33 +509,19 @@ class CIFAR(object):
             
             trainIndices, testIndices = self.create_subclass_dataset(self.params.sub_classes) 
             
-            if not os.path.isfile(trainIndFile) or not os.path.isfile(valIndFile):
+            if not splitIndexSrc.has_class_indices(trainIndFile) or not splitIndexSrc.has_class_indices(valIndFile):
             #{{{
                 # does not write to trainIndices and testIndices
-                print('Creating JSON with per coarse class train and val indices')
-                ccTrain = {cc:[] for cc in self.coarseYNames}
-                ccVal = {cc:[] for cc in self.coarseYNames}
-                for sc in self.coarseYNames:
-                    train_indices, test_indices = self.create_subclass_dataset([sc]) 
-                    train, val = self.get_validation_set(train_indices)
-                    ccTrain[sc] = train
-                    ccVal[sc] = val
-                with open(trainIndFile, 'w') as tFile: 
-                    json.dump(ccTrain, tFile)
-                with open(valIndFile, 'w') as vFile:
-                    json.dump(ccVal, vFile)
+                print('Creating per coarse class train and val indices')
+                train, val = self.get_validation_set(np.arange(len(self.trainFineY)))
+                trainClasses, trainBuckets = splitIndexSrc.class_buckets(self.trainCoarseY, train)
+                valClasses, valBuckets = splitIndexSrc.class_buckets(self.trainCoarseY, val)
+                splitIndexSrc.save_class_indices(trainIndFile, {self.coarseYNames[c]:b for c, b in zip(trainClasses, trainBuckets)})
+                splitIndexSrc.save_class_indices(valIndFile, {self.coarseYNames[c]:b for c, b in zip(valClasses, valBuckets)})
             #}}}
             
-            with open(trainIndFile, 'r') as tF:
-                ccTrainIndices = json.load(tF)
-            with open(valIndFile, 'r') as vF:
-                ccValIndices = json.load(vF)
-            
-            trainIndices = []
-            valIndices = []
-            for cc in self.params.sub_classes:
-                trainIndices += ccTrainIndices[cc]
-                valIndices += ccValIndices[cc]
+            trainIndices = splitIndexSrc.load_class_indices(trainIndFile, self.params.sub_classes)
+            valIndices = splitIndexSrc.load_class_indices(valIndFile, self.params.sub_classes)
             self.trainIndices = trainIndices 
             self.valIndices = valIndices
             self.testIndices = testIndices
@@ -571,17 +544,11 @@ class CIFAR(object):
                 trainIndFile = os.path.join(params.data_location, trainIndFileName)
                 valIndFile = os.path.join(params.data_location, valIndFileName)
 
-            with open(trainIndFile, 'r') as csvFile:
-                csvReader = csv.reader(csvFile, delimiter=',')
-                trainIndices = next(csvReader)
-                trainIndices = [int(x) for x in trainIndices]
-                self.trainIndices = trainIndices
-            
-            with open(valIndFile, 'r') as csvFile:
-                csvReader = csv.reader(csvFile, delimiter=',')
-                valIndices = next(csvReader)
-                valIndices = [int(x) for x in valIndices]
-                self.valIndices = valIndices
+            # memory mapped from the binary index next to the CSV files, which are converted on first use
+            trainIndices = splitIndexSrc.load_indices(trainIndFile)
+            self.trainIndices = trainIndices
+            valIndices = splitIndexSrc.load_indices(valIndFile)
+            self.valIndices = valIndices
         #}}}
         
         else:
@@ -619,23 +586,17 @@ class ImageNet(object):
         classes, labelMap = self.iNet.get_subclasses(superclasses, balanced=False)
         iNetClasses = [cls for clss in classes for cls in clss]
         print(f"Subset {self.params.pruningParams['sub_name']} has {len(iNetClasses)} classes")
-        self.trainIndicesByClass = {k:[] for k in iNetClasses}
-        [self.trainIndicesByClass[x[1]].append(i) for i,x in enumerate(trainSet.imgs) if x[1] in iNetClasses] 
+        self.trainTargets = np.asarray(trainSet.targets)
+        self.trainSubset = splitIndexSrc.subset(self.trainTargets, iNetClasses)
         trainIndices, valIndices = self.get_validation_set()
-        testIndices = [i for i,x in enumerate(testSet.imgs) if x[1] in iNetClasses] 
+        testIndices = splitIndexSrc.subset(testSet.targets, iNetClasses)
 
         return trainIndices, valIndices, testIndices
     #}}}
 
     def get_validation_set(self):
     #{{{
-        p = self.params.trainValSplit
-        tI = []
-        vI = [] 
-        for k,v in self.trainIndicesByClass.items():
-            tI += v[:int(len(v)*p)]
-            vI += v[int(len(v)*p):]
-        return tI, vI
+        return splitIndexSrc.stratified_split(self.trainTargets, self.trainSubset, self.params.trainValSplit)
     #}}}
     
     def create_loaders(self, trainSet, testSet):
@@ -651,22 +612,18 @@ class ImageNet(object):
             valIndFile = os.path.join(self.params.data_location, valIndFileName)
             testIndFile = os.path.join(self.params.data_location, testIndFileName)
 
-            with open(trainIndFile, 'r') as csvFile:
-                csvReader = csv.reader(csvFile, delimiter=',')
-                trainIndices = next(csvReader)
-                trainIndices = [int(x) for x in trainIndices]
-            
-            with open(valIndFile, 'r') as csvFile:
-                csvReader = csv.reader(csvFile, delimiter=',')
-                valIndices = next(csvReader)
-                valIndices = [int(x) for x in valIndices]
-            
-            with open(testIndFile, 'r') as csvFile: 
-                csvReader = csv.reader(csvFile, delimiter=',')
-                testIndices = next(csvReader)
-                testIndices = [int(x) for x in testIndices]
+            # memory mapped from the binary index next to the CSV files, which are converted on first use
+            trainIndices = splitIndexSrc.load_indices(trainIndFile)
+            valIndices = splitIndexSrc.load_indices(valIndFile)
+            testIndices = splitIndexSrc.load_indices(testIndFile)
         #}}}
 
+        if self.params.imagenetShards != '':
+            trainLoader = trainSet.loader(trainIndices, self.params.train_batch, self.params.workers)
+            valLoader = trainSet.loader(valIndices, self.params.test_batch, self.params.workers)
+            testLoader = testSet.loader(testIndices, self.params.test_batch, self.params.workers)
+            return trainLoader, valLoader, testLoader
+
         trainLoader = torch.utils.data.DataLoader(trainSet, batch_size=self.params.train_batch, num_workers=self.params.workers, sampler = torch.utils.data.sampler.SubsetRandomSampler(trainIndices))
         valLoader = torch.utils.data.DataLoader(trainSet, batch_size=self.params.test_batch, num_workers=self.params.workers, sampler = torch.utils.data.sampler.SubsetRandomSampler(valIndices))
         testLoader = torch.utils.data.DataLoader(testSet, batch_size=self.params.test_batch, num_workers=self.params.workers, sampler = torch.utils.data.sampler.SubsetRandomSampler(testIndices))
@@ -694,8 +651,15 @@ class ImageNet(object):
                 torchvision.transforms.Normalize((0.485,0.456,0.406), (0.229,0.224,0.225))
         ])
         
-        trainSet = torchvision.datasets.ImageFolder(trainDir, trainTransform)
-        testSet = torchvision.datasets.ImageFolder(testDir, testTransform)
+        # shards written by convert_shards.py hold the same samples in the same order as the folders
+        if self.params.imagenetShards != '':
+            # IterableDataset is only part of torch 1.2 and later, the module is imported when it is used
+            import src.shard_dataset as shardDatasetSrc
+            trainSet = shardDatasetSrc.ShardStream(os.path.join(self.params.imagenetShards, 'train'), trainTransform, self.params.shuffleBuffer)
+            testSet = shardDatasetSrc.ShardStream(os.path.join(self.params.imagenetShards, 'validation'), testTransform, self.params.shuffleBuffer)
+        else:
+            trainSet = torchvision.datasets.ImageFolder(trainDir, trainTransform)
+            testSet = torchvision.datasets.ImageFolder(testDir, testTransform)
         
         trainLoader, valLoader, testLoader = self.create_loaders(trainSet, testSet)
 
@@ -67,7 +67,17 @@ class ModelCreator(object):
         return torch.nn.CrossEntropyLoss()
 
     def setup_optimiser(self, params, model):
-        return torch.optim.SGD(model.parameters(), lr=params.lr, momentum=params.momentum, weight_decay=params.weight_decay)
+        if params.optimizer == 'SGD':
+            return torch.optim.SGD(model.parameters(), lr=params.lr, momentum=params.momentum, weight_decay=params.weight_decay)
+        elif params.optimizer == 'Adam':
+            return torch.optim.Adam(model.parameters(), lr=params.lr, betas=params.betas, eps=params.eps, weight_decay=params.weight_decay)
+        elif params.optimizer == 'AdamW':
+            # torch.optim.AdamW is part of torch 1.2 and later
+            if not hasattr(torch.optim, 'AdamW'):
+                raise ValueError("Optimizer 'AdamW' needs torch 1.2 or later, this is torch {}".format(torch.__version__))
+            return torch.optim.AdamW(model.parameters(), lr=params.lr, betas=params.betas, eps=params.eps, weight_decay=params.weight_decay)
+        else:
+            raise ValueError("Optimizer should be one of 'SGD', 'Adam' or 'AdamW' (LARS is only available with MuPPET)")
 
     
 
@@ -29,19 +29,26 @@ class Application(appSrc.Application):
     def setup_others(self):
         self.preproc = preprocSrc.Preproc()
         self.mc = mcSrc.ModelCreator()
-        self.quantizer = quantizeSrc.Quantizer(self.params.roundMeth)
+        self.quantizer = quantizeSrc.Quantizer(self.params.roundMeth, self.params.syncFree, self.params.manual_seed, self.params.sfRefreshInterval, self.params.sfSatThreshold, self.params.intStorage, self.params.telemetryPath, self.params.telemetrySampleRate)
         self.trainer = trainingSrc.Trainer(self.quantizer)
         self.inferer = inferenceSrc.Inferer()
         self.policy = policySrc.Policy(self.params) 
 
     def setup_model(self):
         print('==> Setting up quantized Model')
+        if self.params.intStorage and len(self.params.gpuList) > 1:
+            raise ValueError('Int_Storage is only supported on a single GPU')
         self.model, self.criterion, self.optimiser = self.mc.setup_model(self.params, self.quantizer)
         self.scaler = scaleSrc.Scaler(self.model, self.quantizer, self.params)
-        self.scaler.register_hooks()
+        if self.params.runMuppet and self.params.perLayerPrecision:
+            self.policy.setup_layers(self.scaler, self.optimiser)
         self.sfHolder = quantLayersSrc.SFHolder()
         
     def run_training(self):
         # train model 
         print('==> Performing Training')
-        self.trainer.train_network(self.params, None, self.checkpointer, self.train_loader, self.test_loader, self.valLoader, self.model, self.criterion, self.optimiser, self.inferer, self.policy, self.scaler)
+        # telemetry written so far is flushed even if training fails
+        try:
+            self.trainer.train_network(self.params, None, self.checkpointer, self.train_loader, self.test_loader, self.valLoader, self.model, self.criterion, self.optimiser, self.inferer, self.policy, self.scaler)
+        finally:
+            self.quantizer.close()
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import src.muppet.quantize as quantizeSrc
+import src.muppet.quant_layers as ql
+import src.muppet.model_surgery as model_surgery
+
+import torch
+import torch.nn as nn
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Fused Conv-BN-ReLU benchmark')
+    parser.add_argument('--channels', default=128, type=int, help='input and output channels of the block')
+    parser.add_argument('--size', default=32, type=int, help='spatial size of the input')
+    parser.add_argument('--batch', default=64, type=int, help='batch size')
+    parser.add_argument('--iters', default=10, type=int, help='timed forward/backward passes')
+    args = parser.parse_args()
+    return args
+
+def setup_block(args, fuse):
+    torch.manual_seed(0)
+    block = nn.Sequential(ql.QuantConv2d(args.channels, args.channels, kernel_size=3, padding=1, bias=False), nn.BatchNorm2d(args.channels), nn.ReLU(inplace=True))
+    if fuse:
+        block = model_surgery.fuse_conv_bn_relu(block)
+
+    quantizer = quantizeSrc.Quantizer('Stochastic')
+    for name, module in block.named_modules():
+        if isinstance(module, ql.QuantConv2d):
+            module.setup_quantizer(quantizer)
+            module.siteName = name
+    return block.train()
+
+def measure(args, fuse):
+    block = setup_block(args, fuse)
+    inputs = torch.randn(args.batch, args.channels, args.size, args.size, requires_grad=True)
+
+    saved = {'bytes': 0}
+    def counting_pack(tensor):
+        saved['bytes'] += tensor.numel() * tensor.element_size()
+        return tensor
+
+    block(inputs).sum().backward()
+    start = time.time()
+    for i in range(args.iters):
+        saved['bytes'] = 0
+        with torch.autograd.graph.saved_tensors_hooks(counting_pack, lambda tensor: tensor):
+            out = block(inputs)
+        out.sum().backward()
+
+    return (time.time() - start) / args.iters, saved['bytes']
+
+def main():
+    args = parse_command_line_args()
+
+    print('Block,\t\tms/iter,\tSaved for backward (MB)')
+    for fuse in [False, True]:
+        perIter, saved = measure(args, fuse)
+        print('{},\t{:10.3f},\t{:10.2f}'.format('Fused' if fuse else 'Unfused', perIter * 1e3, saved / 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import types
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import src.muppet.quantize as quantizeSrc
+import src.muppet.quant_sgd as qsgd
+import src.muppet.scaler as scaleSrc
+import src.muppet.policy as policySrc
+import src.muppet.models.cifar.resnet as resnet
+
+import torch
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Flat optimizer buffers benchmark')
+    parser.add_argument('--depth', default=110, type=int, help='depth of the CIFAR ResNet')
+    parser.add_argument('--batch', default=32, type=int, help='batch size')
+    parser.add_argument('--bit-width', default=8, type=int, help='target bit width')
+    parser.add_argument('--iters', default=5, type=int, help='timed training steps per configuration')
+    args = parser.parse_args()
+    return args
+
+def measure(args, flat):
+    torch.manual_seed(0)
+    params = types.SimpleNamespace(bitWidth=args.bit_width, dataType='Fixed', gdInterval=1, precEpochSchedule=[], sumOfNorms={}, sumOfGrads={})
+    quantizer = quantizeSrc.Quantizer('Stochastic')
+    model = resnet.resnet(depth=args.depth, num_classes=10)
+    optimiser = qsgd.QuantSGD(model.parameters(), quantizer, lr=0.1, momentum=0.9, weight_decay=1e-4)
+    if flat:
+        optimiser.flatten()
+    scaleSrc.Scaler(model, quantizer, params)
+    policy = policySrc.Policy(types.SimpleNamespace(epochs=1, **vars(params)))
+
+    inputs = torch.randn(args.batch, 3, 32, 32)
+    compute = 0
+    update = 0
+    for i in range(args.iters + 1):
+        start = time.time()
+        optimiser.zero_grad()
+        model(inputs).sum().backward()
+        mid = time.time()
+        optimiser.step(params)
+        policy.accumulate(model, i, optimiser)
+        end = time.time()
+
+        # the first step allocates the buffers
+        if i > 0:
+            compute += mid - start
+            update += end - mid
+
+    return compute / args.iters, update / args.iters
+
+def main():
+    args = parse_command_line_args()
+
+    print('Buffers,\tForward/backward (ms),\tOptimizer+policy (ms),\tOverhead (%)')
+    for flat in [False, True]:
+        compute, update = measure(args, flat)
+        print('{},\t\t{:10.3f},\t\t{:10.3f},\t\t{:6.2f}'.format('flat' if flat else 'per tensor', compute * 1e3, update * 1e3, 100 * update / (compute + update)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import types
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import src.muppet.quantize as quantizeSrc
+import src.muppet.quant_sgd as qsgd
+
+import torch
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Fused optimizer step benchmark')
+    parser.add_argument('--round-meth', default='Simple', type=str, help='rounding method passed to the quantizer')
+    parser.add_argument('--total-numel', default=1<<22, type=int, help='elements shared out across the parameters')
+    parser.add_argument('--num-params', default=128, type=int, help='number of parameter tensors')
+    parser.add_argument('--bit-width', default=8, type=int, help='target bit width')
+    parser.add_argument('--iters', default=20, type=int, help='timed steps per configuration')
+    parser.add_argument('--device', default='cpu', type=str, help='device to run on')
+    args = parser.parse_args()
+    return args
+
+def sync(device):
+    if 'cuda' in device:
+        torch.cuda.synchronize(device)
+
+def run(args, fused, grads):
+    torch.manual_seed(0)
+    weights = [torch.nn.Parameter(torch.randn(args.total_numel // args.num_params, device=args.device)) for i in range(args.num_params)]
+    quantizer = quantizeSrc.Quantizer(args.round_meth, seed=0)
+    optimiser = qsgd.QuantSGD(weights, quantizer, lr=0.1, momentum=0.9, weight_decay=1e-4, nesterov=True, fusedStep=fused)
+    optimiser.flatten()
+    params = types.SimpleNamespace(bitWidth=args.bit_width, dataType='DFixed')
+
+    elapsed = 0
+    for i, grad in enumerate(grads):
+        for w, g in zip(weights, grad):
+            w.grad.copy_(g)
+        sync(args.device)
+        start = time.time()
+        optimiser.step(params)
+        sync(args.device)
+        # the first step allocates the momentum buffers
+        if i > 0:
+            elapsed += time.time() - start
+
+    return weights, optimiser.param_groups[0]['fpWeights'], elapsed / (len(grads) - 1)
+
+def main():
+    args = parse_command_line_args()
+    grads = [[torch.randn(args.total_numel // args.num_params, device=args.device) for i in range(args.num_params)] for j in range(args.iters + 1)]
+
+    unfusedWeights, unfusedFp, unfused = run(args, False, grads)
+    fusedWeights, fusedFp, fused = run(args, True, grads)
+
+    identical = all(torch.equal(a, b) for a, b in zip(unfusedWeights + unfusedFp, fusedWeights + fusedFp))
+    print('Unfused (ms),\tFused (ms),\tBit identical')
+    print('{:10.3f},\t{:10.3f},\t{}'.format(unfused * 1e3, fused * 1e3, identical))
+
+if __name__ == '__main__':
+    main()
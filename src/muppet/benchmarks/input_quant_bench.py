@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import src.muppet.quantize as quantizeSrc
+
+import torch
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Per sample input quantization benchmark')
+    parser.add_argument('--batch', default=128, type=int, help='batch size')
+    parser.add_argument('--size', default=32, type=int, help='input height and width')
+    parser.add_argument('--bit-width', default=8, type=int, help='target bit width')
+    parser.add_argument('--iters', default=20, type=int, help='timed batches per configuration')
+    parser.add_argument('--device', default='cuda:0', type=str, help='device to run on')
+    args = parser.parse_args()
+    return args
+
+def per_sample(quantizer, inputs, bitWidth):
+    for i in range(len(inputs)):
+        inputs[i], _ = quantizer.quantize_inputs(inputs[i].data, bitWidth, "inputs")
+    return inputs
+
+def batched(quantizer, inputs, bitWidth):
+    inputs, _ = quantizer.quantize_batch(inputs, bitWidth, "inputs")
+    return inputs
+
+def measure(args, fn):
+    torch.manual_seed(0)
+    quantizer = quantizeSrc.Quantizer('Stochastic')
+    inputs = torch.randn(args.batch, 3, args.size, args.size, device=args.device)
+
+    total = 0
+    for i in range(args.iters + 1):
+        batch = inputs.clone()
+        if 'cuda' in args.device:
+            torch.cuda.synchronize(args.device)
+        start = time.time()
+        fn(quantizer, batch, args.bit_width)
+        if 'cuda' in args.device:
+            torch.cuda.synchronize(args.device)
+        if i > 0:
+            total += time.time() - start
+    return total / args.iters
+
+def main():
+    args = parse_command_line_args()
+
+    print('Quantization,\tPer batch (ms)')
+    for name, fn in [('per sample', per_sample), ('batched', batched)]:
+        print('{},\t{:10.3f}'.format(name, measure(args, fn) * 1e3))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import contextlib
+import argparse
+import types
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import src.muppet.quantize as quantizeSrc
+import src.muppet.quant_sgd as qsgd
+import src.muppet.scaler as scaleSrc
+import src.muppet.int_storage as int_storage
+import src.muppet.models.cifar as models
+
+import torch
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Integer storage memory benchmark')
+    parser.add_argument('--depth', default=56, type=int, help='depth of the CIFAR ResNet')
+    parser.add_argument('--batch', default=128, type=int, help='training batch size')
+    parser.add_argument('--bit-width', default=8, type=int, help='target bit width')
+    parser.add_argument('--device', default='cpu', type=str, help='device to run on')
+    args = parser.parse_args()
+    return args
+
+def measure(args, intStorage):
+    torch.manual_seed(0)
+    device = torch.device(args.device)
+    params = types.SimpleNamespace(bitWidth=args.bit_width, dataType='DFixed')
+    quantizer = quantizeSrc.Quantizer('Stochastic', intStorage=intStorage)
+
+    model = torch.nn.DataParallel(models.resnet(num_classes=100, depth=args.depth)).to(device)
+    criterion = torch.nn.CrossEntropyLoss()
+    optimiser = qsgd.QuantSGD(model.parameters(), quantizer, lr=0.01, momentum=0.9, weight_decay=1e-4)
+    scaler = scaleSrc.Scaler(model, quantizer, params)
+    model.train()
+
+    inputs = torch.randn(args.batch, 3, 32, 32, device=device)
+    targets = torch.randint(0, 100, (args.batch,), device=device)
+
+    # count the bytes autograd keeps for backward, after the hooks of int storage ran
+    saved = {'bytes': 0}
+    def counting_pack(tensor):
+        packed = int_storage.pack(tensor) if intStorage else tensor
+        values = packed.values if isinstance(packed, int_storage.QuantizedTensor) else packed
+        saved['bytes'] += values.numel() * values.element_size()
+        return packed
+
+    for step in range(2):
+        if 'cuda' in args.device and hasattr(torch.cuda, 'reset_peak_memory_stats'):
+            torch.cuda.reset_peak_memory_stats(device)
+        saved['bytes'] = 0
+
+        # without saved_tensors_hooks the saved activations can neither be packed nor counted
+        hooks = torch.autograd.graph.saved_tensors_hooks(counting_pack, int_storage.unpack) if int_storage.hooks_available() else contextlib.nullcontext()
+        with hooks:
+            loss = criterion(model(inputs), targets)
+        model.zero_grad()
+        loss.backward()
+        optimiser.step(params)
+
+    weightBytes = 0
+    for p in model.parameters():
+        values = p.quantized.values if int_storage.is_compressed(p) else p.data
+        weightBytes += values.numel() * values.element_size()
+
+    peak = torch.cuda.max_memory_allocated(device) if 'cuda' in args.device else None
+    return saved['bytes'] if int_storage.hooks_available() else None, weightBytes, peak
+
+def main():
+    args = parse_command_line_args()
+
+    print('Storage,\tSaved for backward (MB),\tModel weights (MB),\tPeak allocated (MB)')
+    for intStorage in [False, True]:
+        saved, weights, peak = measure(args, intStorage)
+        peak = '{:10.2f}'.format(peak / 1e6) if peak is not None else 'n/a'
+        saved = '{:10.2f}'.format(saved / 1e6) if saved is not None else 'n/a'
+        print('{},\t\t{},\t\t\t{:10.2f},\t\t{}'.format('Int' if intStorage else 'FP32', saved, weights / 1e6, peak))
+
+if __name__ == '__main__':
+    main()
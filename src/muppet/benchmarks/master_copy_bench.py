@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import types
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import src.muppet.quantize as quantizeSrc
+import src.muppet.quant_sgd as qsgd
+import src.muppet.scaler as scaleSrc
+import src.muppet.master_copy as master_copy
+import src.muppet.models.cifar.resnet as resnet
+
+import torch
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='FP32 master copy memory benchmark')
+    parser.add_argument('--depth', default=110, type=int, help='depth of the CIFAR ResNet')
+    parser.add_argument('--batch', default=32, type=int, help='batch size')
+    parser.add_argument('--bit-width', default=8, type=int, help='target bit width')
+    parser.add_argument('--iters', default=5, type=int, help='timed training steps per configuration')
+    parser.add_argument('--device', default='cuda:0', type=str, help='device to run on')
+    args = parser.parse_args()
+    return args
+
+def master_bytes(optimiser):
+    return sum(fp.numel() * fp.element_size() for group in optimiser.param_groups for fp in group['fpWeights'] if fp.device.type != 'cpu')
+
+def measure(args, mode):
+    torch.manual_seed(0)
+    if 'cuda' in args.device:
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(args.device)
+
+    params = types.SimpleNamespace(bitWidth=args.bit_width, dataType='DFixed')
+    quantizer = quantizeSrc.Quantizer('Stochastic')
+    model = resnet.resnet(depth=args.depth, num_classes=10).to(args.device)
+    optimiser = qsgd.QuantSGD(model.parameters(), quantizer, lr=0.1, momentum=0.9, weight_decay=1e-4, masterCopy=mode)
+    optimiser.setup_master()
+    scaleSrc.Scaler(model, quantizer, params)
+
+    inputs = torch.randn(args.batch, 3, 32, 32, device=args.device)
+    step = 0
+    for i in range(args.iters + 1):
+        optimiser.zero_grad()
+        model(inputs).sum().backward()
+        if 'cuda' in args.device:
+            torch.cuda.synchronize(args.device)
+        start = time.time()
+        optimiser.step(params)
+        if 'cuda' in args.device:
+            torch.cuda.synchronize(args.device)
+        if i > 0:
+            step += time.time() - start
+
+    peak = torch.cuda.max_memory_allocated(args.device) if 'cuda' in args.device else 0
+    return master_bytes(optimiser), peak, step / args.iters
+
+def main():
+    args = parse_command_line_args()
+
+    print('Master copy,\tOn device (MB),\tPeak allocated (MB),\tOptimizer step (ms)')
+    for mode in master_copy.MODES:
+        onDevice, peak, step = measure(args, mode)
+        print('{},\t\t{:10.2f},\t{:10.2f},\t\t{:10.3f}'.format(mode, onDevice / 2**20, peak / 2**20, step * 1e3))
+
+if __name__ == '__main__':
+    main()
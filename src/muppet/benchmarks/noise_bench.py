@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from src.muppet.noise_pool import NoisePool
+
+import torch
+
+# activation, gradient and weight sizes seen by a CIFAR AlexNet step at batch 128
+SIZES = [(128, 64, 8, 8), (128, 192, 4, 4), (128, 384, 2, 2), (128, 256, 2, 2), (128, 100), (192, 64, 5, 5), (384, 192, 3, 3)]
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Stochastic rounding noise benchmark')
+    parser.add_argument('--iters', default=200, type=int, help='timed passes over all tensor sizes')
+    parser.add_argument('--seed', default=0, type=int, help='seed used for the noise pool')
+    args = parser.parse_args()
+    return args
+
+def fresh_noise(size):
+    # per call allocation and RNG launch as done before the noise pool
+    return torch.FloatTensor(*size).uniform_(-0.5, 0.5)
+
+def bench(getNoise, iters):
+    start = time.time()
+    for i in range(iters):
+        for size in SIZES:
+            getNoise(size)
+    return time.time() - start
+
+def main():
+    args = parse_command_line_args()
+    device = torch.device('cpu')
+    pool = NoisePool(args.seed)
+
+    fresh = bench(fresh_noise, args.iters)
+    pooled = bench(lambda size: pool.get(size, device), args.iters)
+
+    # two pools with the same seed must produce identical noise for identical call sequences
+    poolA, poolB = NoisePool(args.seed), NoisePool(args.seed)
+    reproducible = all(torch.equal(poolA.get(size, device), poolB.get(size, device)) for size in SIZES * 50)
+
+    numel = sum(torch.Size(size).numel() for size in SIZES) * args.iters
+    print('Provider,\tMSamples/sec')
+    print('Fresh,\t\t{:10.2f}'.format(numel / fresh / 1e6))
+    print('Pool,\t\t{:10.2f}'.format(numel / pooled / 1e6))
+    print('Reproducible under a fixed seed: {}'.format(reproducible))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import src.muppet.quantize as quantizeSrc
+
+import torch
+
+# full passes over the tensor made by each backend, as (reads, writes)
+#   reference : clone (1r 1w), max/min for the zero check (2r), max/min for the
+#               inf check (2r), max/min in findSfAndScale (2r), mul_ by 2^sf
+#               (1r 1w), round (1r 1w), mul_ by 2^-sf (1r 1w)
+#   fused     : aminmax (1r), fused multiply-round-rescale (1r 1w)
+# stochastic rounding adds the noise fill (1w) plus the noise add (2r 1w) in the
+# reference backend, or one extra read of the noise in the fused backend
+PASSES = {
+    'Simple'          : (10, 4),
+    'Stochastic'      : (12, 6),
+    'FusedSimple'     : (2, 1),
+    'FusedStochastic' : (3, 2),
+}
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Quantizer microbenchmark')
+    parser.add_argument('--numel', default=1<<22, type=int, help='number of elements in the quantized tensor')
+    parser.add_argument('--bit-width', default=8, type=int, help='target bit width')
+    parser.add_argument('--iters', default=50, type=int, help='timed calls per backend')
+    parser.add_argument('--device', default='cpu', type=str, help='device to run on')
+    args = parser.parse_args()
+    return args
+
+def sync(device):
+    if 'cuda' in device:
+        torch.cuda.synchronize(device)
+
+def bench(roundMeth, inputs, bitWidth, iters, device):
+    quantizer = quantizeSrc.Quantizer(roundMeth)
+
+    # warm up so that the scripted kernels are compiled before timing
+    for i in range(3):
+        quantizer.quantize_inputs(inputs, bitWidth)
+    sync(device)
+
+    start = time.time()
+    for i in range(iters):
+        quantizer.quantize_inputs(inputs, bitWidth)
+    sync(device)
+
+    return (time.time() - start) / iters
+
+def main():
+    args = parse_command_line_args()
+    inputs = torch.randn(args.numel, device=args.device)
+    elemSize = inputs.element_size()
+
+    print('Backend,\t\tMBytes/call,\tms/call,\tGB/s')
+    for roundMeth, (reads, writes) in PASSES.items():
+        if roundMeth.endswith('Stochastic') and not roundMeth.startswith('Fused') and 'cuda' not in args.device:
+            # reference stochastic rounding only runs on CUDA devices
+            continue
+
+        perCall = bench(roundMeth, inputs, args.bit_width, args.iters, args.device)
+        bytesMoved = (reads + writes) * args.numel * elemSize
+        print('{:16s},\t{:10.2f},\t{:10.3f},\t{:8.2f}'.format(roundMeth, bytesMoved / 1e6, perCall * 1e3, bytesMoved / perCall / 1e9))
+
+if __name__ == '__main__':
+    main()
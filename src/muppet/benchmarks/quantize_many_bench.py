@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import src.muppet.quantize as quantizeSrc
+
+import torch
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Batched quantization benchmark')
+    parser.add_argument('--round-meth', default='Stochastic', type=str, help='rounding method passed to the quantizer')
+    parser.add_argument('--total-numel', default=1<<22, type=int, help='elements shared out across the tensors of a group')
+    parser.add_argument('--bit-width', default=8, type=int, help='target bit width')
+    parser.add_argument('--iters', default=20, type=int, help='timed calls per configuration')
+    parser.add_argument('--device', default='cpu', type=str, help='device to run on')
+    args = parser.parse_args()
+    return args
+
+def sync(device):
+    if 'cuda' in device:
+        torch.cuda.synchronize(device)
+
+def timed(fn, iters, device):
+    fn()
+    sync(device)
+    start = time.time()
+    for i in range(iters):
+        fn()
+    sync(device)
+    return (time.time() - start) / iters
+
+def main():
+    args = parse_command_line_args()
+    quantizer = quantizeSrc.Quantizer(args.round_meth)
+
+    # same number of elements split into an increasing number of parameter tensors
+    print('Tensors,\tPer tensor (ms),\tquantize_many (ms)')
+    for numTensors in [8, 32, 128, 512]:
+        tensors = [torch.randn(args.total_numel // numTensors, device=args.device) for i in range(numTensors)]
+
+        perTensor = timed(lambda: [quantizer.quantize_inputs(t, args.bit_width) for t in tensors], args.iters, args.device)
+        batched = timed(lambda: quantizer.quantize_many(tensors, args.bit_width), args.iters, args.device)
+        print('{},\t\t{:10.3f},\t\t{:10.3f}'.format(numTensors, perTensor * 1e3, batched * 1e3))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import src.shard_dataset as shardDatasetSrc
+
+import torch
+import torchvision
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='ImageFolder against sharded ImageNet loading benchmark')
+    parser.add_argument('--folder', required=True, type=str, help='ImageFolder root, e.g. <imagenet>/train')
+    parser.add_argument('--shards', required=True, type=str, help='the same folder converted with convert_shards.py')
+    parser.add_argument('--batch', default=256, type=int, help='batch size')
+    parser.add_argument('--workers', default=8, type=int, help='data loading workers')
+    parser.add_argument('--batches', default=50, type=int, help='timed batches per loader')
+    args = parser.parse_args()
+    return args
+
+def train_transform():
+    return torchvision.transforms.Compose([
+            torchvision.transforms.RandomResizedCrop(224),
+            torchvision.transforms.RandomHorizontalFlip(),
+            torchvision.transforms.ToTensor(),
+            torchvision.transforms.Normalize((0.485,0.456,0.406), (0.229,0.224,0.225))
+    ])
+
+def measure(loader, batches):
+    # the first batch includes the worker startup and is not timed
+    it = iter(loader)
+    next(it)
+    images = 0
+    start = time.time()
+    for i in range(batches):
+        inputs, _ = next(it)
+        images += inputs.size(0)
+    return images / (time.time() - start)
+
+def main():
+    args = parse_command_line_args()
+
+    folder = torchvision.datasets.ImageFolder(args.folder, train_transform())
+    sampler = torch.utils.data.sampler.RandomSampler(folder)
+    folderLoader = torch.utils.data.DataLoader(folder, batch_size=args.batch, num_workers=args.workers, sampler=sampler)
+    # mean bytes read per image, estimated from a sample of the files
+    sample = torch.randperm(len(folder.samples))[:1000].tolist()
+    folderBytes = sum(os.path.getsize(folder.samples[i][0]) for i in sample) / len(sample)
+
+    stream = shardDatasetSrc.ShardStream(args.shards, train_transform())
+    streamLoader = stream.loader(None, args.batch, args.workers)
+    shards = stream.manifest['shards']
+    streamBytes = sum(shard['bytes'] for shard in shards) / sum(shard['count'] for shard in shards)
+
+    print('Loader,\t\tImages/sec,\tRead (MB/s)')
+    for name, loader, perImage in [('ImageFolder', folderLoader, folderBytes), ('Shards', streamLoader, streamBytes)]:
+        rate = measure(loader, args.batches)
+        print('{},\t{:10.1f},\t{:10.1f}'.format(name, rate, rate * perImage / 2**20))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+import os
+import sys
+import time
+import argparse
+import configparser as cp
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import src.param_parser as ppSrc
+import src.input_preprocessor as preprocSrc
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Time from startup to the first training batch')
+    parser.add_argument('--config-file', required=True, type=str, help='config file with the dataset to load')
+    parser.add_argument('--runs', default=2, type=int, help='number of startups, the first one builds any cached index')
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_command_line_args()
+    config = cp.ConfigParser()
+    config.read(args.config_file)
+    params = ppSrc.Params(config)
+
+    print('Run,\tLoaders (s),\tFirst batch (s)')
+    for run in range(args.runs):
+        start = time.time()
+        trainLoader, valLoader, testLoader = preprocSrc.Preproc().import_and_preprocess_dataset(params)
+        loaders = time.time()
+        next(iter(trainLoader))
+        end = time.time()
+        print('{},\t{:10.3f},\t{:10.3f}'.format(run, loaders - start, end - loaders))
+
+if __name__ == '__main__':
+    main()
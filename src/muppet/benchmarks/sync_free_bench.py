@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import argparse
+import types
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+import src.muppet.quantize as quantizeSrc
+import src.muppet.quant_sgd as qsgd
+import src.muppet.scaler as scaleSrc
+import src.muppet.training as trainingSrc
+import src.muppet.models.cifar as models
+
+import torch
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Sync free quantization benchmark')
+    parser.add_argument('--round-meth', default='Simple', type=str, help='rounding method passed to the quantizer')
+    parser.add_argument('--bit-width', default=8, type=int, help='target bit width')
+    parser.add_argument('--batch', default=128, type=int, help='training batch size')
+    parser.add_argument('--steps', default=20, type=int, help='timed training steps per mode')
+    args = parser.parse_args()
+    return args
+
+def setup_params(args):
+    return types.SimpleNamespace(arch='alexnet', dataset='cifar100', evaluate=False, bitWidth=args.bit_width, dataType='DFixed')
+
+def steps_per_sec(args, syncFree):
+    torch.manual_seed(0)
+    params = setup_params(args)
+    quantizer = quantizeSrc.Quantizer(args.round_meth, syncFree)
+    trainer = trainingSrc.Trainer(quantizer)
+
+    # DataParallel without GPUs only wraps the model, the scaler expects the 'module' entry
+    model = torch.nn.DataParallel(models.alexnet(num_classes=100))
+    criterion = torch.nn.CrossEntropyLoss()
+    optimiser = qsgd.QuantSGD(model.parameters(), quantizer, lr=0.01, momentum=0.9, weight_decay=1e-4)
+    scaler = scaleSrc.Scaler(model, quantizer, params)
+    model.train()
+
+    inputs = torch.randn(args.batch, 3, 32, 32)
+    targets = torch.randint(0, 100, (args.batch,))
+
+    def step():
+        quantInputs, _ = quantizer.quantize_inputs(inputs, params.bitWidth, "inputs")
+        trainer.train(model, criterion, optimiser, quantInputs, targets, params)
+        quantizer.step()
+
+    step()
+    start = time.time()
+    for i in range(args.steps):
+        step()
+
+    return args.steps / (time.time() - start)
+
+def main():
+    args = parse_command_line_args()
+    base = steps_per_sec(args, False)
+    syncFree = steps_per_sec(args, True)
+
+    print('Mode,\t\tSteps/sec')
+    print('Host sync,\t{:8.3f}'.format(base))
+    print('Sync free,\t{:8.3f}'.format(syncFree))
+    print('Speedup,\t{:8.3f}x'.format(syncFree / base))
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,8 @@ class Checkpointer(cpSrc.Checkpointer):
         # include additional headers relevant to MuPPET
         if params.runMuppet:
             self.headers += ['MeanGD', 'MaxGD', \
-                             'Ratio', 'Threshold', 'GDViolations']
+                             'Ratio', 'Threshold', 'GDViolations', \
+                             'AvgBitWidth', 'RunAvgBitWidth', 'LayerBitWidths']
 
     def setup_values(self, params):
         super().setup_values(params)
@@ -26,6 +27,7 @@ class Checkpointer(cpSrc.Checkpointer):
             ratio = (params.maxGD / params.meanGD).item() if 'torch' in str(type(params.meanGD)) else (params.maxGD / params.meanGD)
             
             self.values += [meanGD, maxGD, ratio, params.threshold, params.gdViolations]
+            self.values += [params.avgBitWidth, params.runAvgBitWidth, ' '.join(str(x) for x in params.siteBitWidths.values())]
 
     def save_checkpoint(self, model_dict, optimiser_dict, params) : 
         if params.printOnly == True:
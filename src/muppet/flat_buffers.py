@@ -0,0 +1,55 @@
+import torch
+
+class FlatGroup(object):
+    # parameters, gradients and FP32 master copies of a param group that share a dtype and device,
+    # each stored in one contiguous buffer with the tensors of the model and optimizer as views into it
+    def __init__(self, weights, fpWeights, idx):
+        self.idx = idx
+        self.lengths = [weights[i].numel() for i in idx]
+
+        self.param = torch.cat([weights[i].data.reshape(-1) for i in idx])
+        self.fp = torch.cat([fpWeights[i].data.reshape(-1) for i in idx])
+        self.grad = torch.zeros_like(self.param)
+        self.momentum = None
+
+        for i, param, fp, grad in zip(idx, self.param.split(self.lengths), self.fp.split(self.lengths), self.grad.split(self.lengths)):
+            shape = weights[i].shape
+            weights[i].data = param.view(shape)
+            fpWeights[i].data = fp.view(shape)
+            weights[i].grad = grad.view(shape)
+
+    def attach_grads(self, weights):
+        # make the gradients of the parameters views into the gradient buffer again, copying in any gradient
+        # that the backward pass allocated outside of it (e.g. after the gradients were set to None)
+        for i, grad in zip(self.idx, self.grad.split(self.lengths)):
+            current = weights[i].grad
+            if current is not None and current.data_ptr() == grad.data_ptr():
+                continue
+            if current is None:
+                grad.zero_()
+            else:
+                grad.copy_(current.data.reshape(-1))
+            weights[i].grad = grad.view(weights[i].shape)
+
+    def momentum_buffer(self, weights, state):
+        # flat momentum buffer, gathered from the per parameter buffers of a loaded optimizer state if there are any
+        if self.momentum is None:
+            bufs = [state[weights[i]].get('momentum_buffer') for i in self.idx]
+            if any(buf is None for buf in bufs):
+                return None
+
+            self.momentum = torch.cat([buf.reshape(-1) for buf in bufs])
+            self.share_momentum(weights, state)
+        return self.momentum
+
+    def share_momentum(self, weights, state):
+        # keep the optimizer state dict in terms of per parameter views
+        for i, buf in zip(self.idx, self.momentum.split(self.lengths)):
+            state[weights[i]]['momentum_buffer'] = buf.view(weights[i].shape)
+
+def flatten(weights, fpWeights):
+    # one FlatGroup per dtype and device
+    keys = {}
+    for i, p in enumerate(weights):
+        keys.setdefault((p.dtype, p.device), []).append(i)
+    return [FlatGroup(weights, fpWeights, idx) for idx in keys.values()]
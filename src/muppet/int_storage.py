@@ -0,0 +1,125 @@
+import warnings
+import contextlib
+import torch
+
+def mantissa_dtype(bitWidth):
+    if bitWidth <= 8:
+        return torch.int8
+    elif bitWidth <= 16:
+        return torch.int16
+    else:
+        return torch.int32
+
+class QuantizedTensor(object):
+    """Integer mantissas and exponent of a dynamic fixed-point tensor.
+
+    The represented value is values * 2^-sf, where sf is either a python int
+    or a 0-dim tensor on the same device as values.
+    """
+    def __init__(self, values, sf, dtype=torch.float32):
+        self.values = values
+        self.sf = sf
+        self.dtype = dtype
+
+    @classmethod
+    def from_quantized(cls, tensor, sf, bitWidth):
+        # tensor already holds quantized values, so the conversion is exact
+        val = 1 << (bitWidth-1)
+        scale = torch.pow(2.0, sf) if isinstance(sf, torch.Tensor) else pow(2.0, sf)
+        values = (tensor * scale).round_().clamp_(-val, val-1).to(mantissa_dtype(bitWidth))
+        return cls(values, sf, tensor.dtype)
+
+    def dequantize(self):
+        invScale = torch.pow(2.0, -self.sf) if isinstance(self.sf, torch.Tensor) else pow(2.0, -self.sf)
+        return self.values.to(self.dtype) * invScale
+
+    def size(self):
+        return self.values.size()
+
+#-------------------------------------------------------------------------------
+# activations saved for backward
+#-------------------------------------------------------------------------------
+def tag(tensor, sf, bitWidth, quantized=None):
+    # mark a tensor as holding quantized values, valid only while it is not modified in place
+    tensor._muppetQuant = (tensor._version, sf, bitWidth, quantized)
+
+def pack(tensor):
+    quantTag = getattr(tensor, '_muppetQuant', None)
+    if quantTag is None or quantTag[0] != tensor._version:
+        return tensor
+
+    version, sf, bitWidth, quantized = quantTag
+    if quantized is not None:
+        return quantized
+    return QuantizedTensor.from_quantized(tensor, sf, bitWidth)
+
+def unpack(packed):
+    # dequantize lazily, when backward actually consumes the saved tensor
+    if isinstance(packed, QuantizedTensor):
+        return packed.dequantize()
+    return packed
+
+def hooks_available():
+    # saved_tensors_hooks is part of torch 1.10 and later
+    return hasattr(torch.autograd, 'graph') and hasattr(torch.autograd.graph, 'saved_tensors_hooks')
+
+_warnedHooks = False
+
+def pack_saved_activations(enabled):
+    global _warnedHooks
+    if enabled and hooks_available():
+        return torch.autograd.graph.saved_tensors_hooks(pack, unpack)
+    if enabled and not _warnedHooks:
+        warnings.warn('Int_Storage: saved_tensors_hooks needs torch 1.10 or later, activations saved for backward are kept in FP32 and only the weights are stored as integers')
+        _warnedHooks = True
+    return contextlib.nullcontext()
+
+#-------------------------------------------------------------------------------
+# weights held by QuantConv2d / QuantLinear
+#-------------------------------------------------------------------------------
+class DequantizeWeight(torch.autograd.Function):
+    # the parameter only carries the gradient, its values come from the integer mantissas
+    @staticmethod
+    def forward(ctx, weight, quantized):
+        return quantized.dequantize()
+
+    @staticmethod
+    def backward(ctx, grad):
+        return grad, None
+
+def is_compressed(param):
+    return hasattr(param, 'quantized')
+
+def compress(param, quantized):
+    # replace the FP32 storage by a 0-stride placeholder of the same shape
+    if not is_compressed(param):
+        param.data = torch.empty((), dtype=param.dtype, device=param.device).expand(param.size())
+    param.quantized = quantized
+
+def release(param, data):
+    if is_compressed(param):
+        del param.quantized
+    param.data = data
+
+def value_of(param):
+    if is_compressed(param):
+        return param.quantized.dequantize()
+    return param.data
+
+def weight_of(param):
+    if not is_compressed(param):
+        return param
+
+    weight = DequantizeWeight.apply(param, param.quantized)
+    tag(weight, param.quantized.sf, None, param.quantized)
+    return weight
+
+def save_to_state_dict(module, destination, prefix):
+    # state dicts always hold FP32 weights
+    if is_compressed(module.weight):
+        destination[prefix + 'weight'] = module.weight.quantized.dequantize()
+
+def decompress(param):
+    # give the parameter real storage again before a state dict is loaded into it
+    if is_compressed(param):
+        release(param, torch.empty(param.size(), dtype=param.dtype, device=param.device))
@@ -0,0 +1,143 @@
+import copy
+import torch
+
+import src.muppet.int_storage as int_storage
+
+MODES = ('Device', 'Host', 'Residual')
+
+class DeviceMaster(object):
+    # FP32 master copy next to the parameters, updated in place
+    def create(self, param):
+        return copy.deepcopy(param)
+
+    def setup(self, group):
+        pass
+
+    def chunks(self, idx, weights):
+        return [idx]
+
+    def prefetch(self, group, chunk):
+        pass
+
+    def load(self, group, chunk):
+        return [group['fpWeights'][i].data for i in chunk]
+
+    def store(self, group, chunk, fps, quantized):
+        pass
+
+    def weights(self, group):
+        return group['fpWeights']
+
+class ChunkedMaster(DeviceMaster):
+    # master copies that are rebuilt on the device are updated a chunk of parameters at a time
+    def __init__(self, chunkNumel):
+        self.chunkNumel = chunkNumel
+
+    def chunks(self, idx, weights):
+        chunks = [[]]
+        numel = 0
+        for i in idx:
+            if numel >= self.chunkNumel:
+                chunks.append([])
+                numel = 0
+            chunks[-1].append(i)
+            numel += weights[i].numel()
+        return chunks
+
+class HostMaster(ChunkedMaster):
+    # FP32 master copy in pinned host memory, the next chunk is copied to the device on a side stream
+    # while the current one is updated, and copied back asynchronously on the compute stream
+    def __init__(self, chunkNumel):
+        super().__init__(chunkNumel)
+        self.stream = None
+        self.pending = None
+
+    def to_host(self, tensor):
+        tensor = tensor.detach().cpu()
+        return tensor.pin_memory() if torch.cuda.is_available() else tensor
+
+    def create(self, param):
+        return self.to_host(param)
+
+    def setup(self, group):
+        for fp in group['fpWeights']:
+            if not fp.is_pinned():
+                fp.data = self.to_host(fp.data)
+
+    def prefetch(self, group, chunk):
+        device = group['params'][chunk[0]].device
+        if device.type != 'cuda':
+            return
+
+        if self.stream is None:
+            self.stream = torch.cuda.Stream(device)
+        # everything queued so far, including the copies back of the previous chunks, lands before the prefetch
+        self.stream.wait_stream(torch.cuda.current_stream(device))
+        with torch.cuda.stream(self.stream):
+            self.pending = (chunk, [group['fpWeights'][i].data.to(device, non_blocking=True) for i in chunk])
+
+    def load(self, group, chunk):
+        device = group['params'][chunk[0]].device
+        if self.pending is None or self.pending[0] is not chunk:
+            return [group['fpWeights'][i].data.to(device) for i in chunk]
+
+        current = torch.cuda.current_stream(device)
+        current.wait_stream(self.stream)
+        fps = self.pending[1]
+        for fp in fps:
+            fp.record_stream(current)
+        self.pending = None
+        return fps
+
+    def store(self, group, chunk, fps, quantized):
+        for i, fp in zip(chunk, fps):
+            host = group['fpWeights'][i].data
+            if host.data_ptr() != fp.data_ptr():
+                host.copy_(fp, non_blocking=True)
+
+    def weights(self, group):
+        # the asynchronous copies back have to land before the host copies are read
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return group['fpWeights']
+
+class ResidualMaster(ChunkedMaster):
+    # only the FP16 residual between the FP32 master weight and its quantized value is kept,
+    # the master weight is rebuilt from the quantized parameter when it is updated
+    def create(self, param):
+        return torch.zeros_like(param.detach(), dtype=torch.float16)
+
+    def setup(self, group):
+        # master copies loaded from a checkpoint hold FP32 weights
+        for p, fp in zip(group['params'], group['fpWeights']):
+            if fp.dtype != torch.float16:
+                fp.data = (fp.data.to(p.device) - int_storage.value_of(p)).half()
+
+    def load(self, group, chunk):
+        fps = []
+        for i in chunk:
+            residual = group['fpWeights'][i].data
+            # parameters that train in FP32 are their own master copy
+            if residual.dtype != torch.float16:
+                fps.append(residual)
+            else:
+                fps.append(int_storage.value_of(group['params'][i]) + residual.float())
+        return fps
+
+    def store(self, group, chunk, fps, quantized):
+        for i, fp, weight in zip(chunk, fps, quantized):
+            value = weight.dequantize() if isinstance(weight, int_storage.QuantizedTensor) else weight
+            group['fpWeights'][i].data = (fp - value).half()
+
+    def weights(self, group):
+        # rebuilt one parameter at a time on the host for checkpoints
+        return [self.load(group, [i])[0].cpu() for i in range(len(group['params']))]
+
+def create(mode, chunkNumel):
+    if mode == 'Device':
+        return DeviceMaster()
+    elif mode == 'Host':
+        return HostMaster(chunkNumel)
+    elif mode == 'Residual':
+        return ResidualMaster(chunkNumel)
+    raise ValueError("Master copy should be one of {}".format(', '.join(MODES)))
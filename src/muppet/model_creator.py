@@ -1,5 +1,8 @@
 import src.muppet.models as models
 import src.muppet.quant_sgd as qsgd
+import src.muppet.quant_adam as qadam
+import src.muppet.quant_lars as qlars
+import src.muppet.model_surgery as model_surgery
 
 import src.model_creator as mcSrc
 
@@ -23,8 +26,16 @@ class ModelCreator(mcSrc.ModelCreator):
         return torch.nn.CrossEntropyLoss()
 
     def setup_optimiser(self, params, model, quantizer):
-        # use quantized SGD optimizer to quantize the gradients and update the model appropriately
-        opt = qsgd.QuantSGD(model.parameters(), quantizer, lr=params.lr, momentum=params.momentum, weight_decay=params.weight_decay)
+        # use a quantized optimizer to quantize the gradients and update the model appropriately
+        master = dict(masterCopy=params.masterCopy, masterChunk=params.masterChunk)
+        if params.optimizer == 'SGD':
+            opt = qsgd.QuantSGD(model.parameters(), quantizer, lr=params.lr, momentum=params.momentum, weight_decay=params.weight_decay, fusedStep=params.fusedStep, **master)
+        elif params.optimizer == 'Adam' or params.optimizer == 'AdamW':
+            opt = qadam.QuantAdam(model.parameters(), quantizer, lr=params.lr, betas=params.betas, eps=params.eps, weight_decay=params.weight_decay, decoupled=(params.optimizer == 'AdamW'), momentBitWidth=params.momentBitWidth, **master)
+        elif params.optimizer == 'LARS':
+            opt = qlars.QuantLARS(model.parameters(), quantizer, lr=params.lr, momentum=params.momentum, weight_decay=params.weight_decay, trustCoefficient=params.trustCoefficient, momentBitWidth=params.momentBitWidth, **master)
+        else:
+            raise ValueError("Optimizer should be one of 'SGD', 'Adam', 'AdamW' or 'LARS'")
 
         if params.resume == True or params.branch == True or params.evaluate == True:
             path = params.pretrained.split('/')
@@ -35,6 +46,10 @@ class ModelCreator(mcSrc.ModelCreator):
             if os.path.exists(masterCopyPath):
                 fp32Weights = torch.load(masterCopyPath)
                 opt.param_groups[0]['fpWeights'] = fp32Weights
+        opt.setup_master()
+
+        if params.flatBuffers:
+            opt.flatten()
             
         return opt
 
@@ -68,6 +83,32 @@ class ModelCreator(mcSrc.ModelCreator):
             else:
                 if params.depth == 18:
                     model = models.__dict__['resnet18'](pretrained=False, progress=False)
+        elif params.arch.startswith('resnext'):
+            if 'cifar' in params.dataset:
+                model = models.__dict__[params.arch](
+                            cardinality=params.cardinality,
+                            num_classes=num_classes,
+                            depth=params.depth,
+                            widen_factor=params.widen_factor,
+                            dropRate=params.dropout
+                        )
+            else:
+                model = models.__dict__[params.arch](baseWidth=params.widen_factor, cardinality=params.cardinality)
+        elif params.arch.startswith('densenet'):
+            model = models.__dict__[params.arch](
+                        num_classes=num_classes,
+                        depth=params.depth,
+                        growthRate=params.growth_rate,
+                        compressionRate=params.compression_rate,
+                        dropRate=params.dropout
+                    )
+        elif params.arch.startswith('wrn'):
+            model = models.__dict__[params.arch](
+                        num_classes=num_classes,
+                        depth=params.depth,
+                        widen_factor=params.widen_factor,
+                        dropRate=params.dropout
+                    )
         elif 'googlenet' in params.arch:
             if params.evaluate == False and params.dataset == 'imagenet':
                 model = models.__dict__[params.arch](num_classes=num_classes, aux_logits=True)
@@ -77,4 +118,10 @@ class ModelCreator(mcSrc.ModelCreator):
         else:
             model = models.__dict__[params.arch](num_classes=num_classes)
 
+        # FP32 architectures are converted, hand written quantized ones are left untouched
+        model = model_surgery.quantize_model(model, params.bitWidth)
+
+        if params.fuseConvBN:
+            model = model_surgery.fuse_conv_bn_relu(model)
+
         return model
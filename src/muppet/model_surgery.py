@@ -0,0 +1,150 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import src.muppet.quant_layers as ql
+
+RELUS = (nn.ReLU, nn.ReLU6)
+RELU_FUNCTIONS = (F.relu, F.relu_, torch.relu, torch.relu_, F.relu6)
+
+def get_module(model, name):
+    module = model
+    for attr in name.split('.'):
+        module = getattr(module, attr)
+    return module
+
+def set_module(model, name, module):
+    path = name.rsplit('.', 1)
+    parent = get_module(model, path[0]) if len(path) == 2 else model
+    setattr(parent, path[-1], module)
+
+#-------------------------------------------------------------------------------
+# FP32 to quantized model conversion
+#-------------------------------------------------------------------------------
+QUANT_COUNTERPARTS = {
+    nn.Conv2d : ql.QuantConv2d,
+    nn.Linear : ql.QuantLinear,
+    nn.AvgPool2d : ql.QuantAvgPool2d,
+    nn.AdaptiveAvgPool2d : ql.QuantAdaptiveAvgPool2d,
+}
+
+def is_quantized(model):
+    # hand written quantized models keep some layers in FP32 on purpose
+    quantTypes = tuple(ql.__dict__[x] for x in ql.__all__)
+    return any(isinstance(m, quantTypes) for m in model.modules())
+
+def quantize_model(model, bitWidth):
+    # swap every FP32 Conv2d / Linear / AvgPool2d / AdaptiveAvgPool2d for its Quant counterpart
+    # the Quant layers take over the existing parameters, so weights and any references held
+    # to them stay valid. Models that already contain Quant layers are left untouched
+    if is_quantized(model):
+        return model
+
+    converted = 0
+    for name, module in list(model.named_modules()):
+        quantClass = QUANT_COUNTERPARTS.get(type(module))
+        if quantClass is None:
+            continue
+        if isinstance(module, nn.Conv2d) and module.padding_mode != 'zeros':
+            continue
+
+        if name == '':
+            model = ql.from_float(module, quantClass, bitWidth)
+        else:
+            set_module(model, name, ql.from_float(module, quantClass, bitWidth))
+        converted += 1
+
+    if converted != 0:
+        print('==> Converted {} layers to quantized layers'.format(converted))
+    return model
+
+#-------------------------------------------------------------------------------
+# Conv-BatchNorm-ReLU fusion
+#-------------------------------------------------------------------------------
+def fusable(conv, bn):
+    return type(conv) == ql.QuantConv2d and isinstance(bn, nn.BatchNorm2d) and bn.affine and bn.track_running_stats
+
+def fx_available():
+    # torch.fx is only part of torch 1.8 and later
+    try:
+        import torch.fx
+        return True
+    except ImportError:
+        return False
+
+def find_chains_traced(model):
+    # follow the dataflow graph, so chains written out in forward (vgg_quant, cifar googlenet) are found too
+    import torch.fx
+
+    class QuantTracer(torch.fx.Tracer):
+        def is_leaf_module(self, m, qualname):
+            return isinstance(m, tuple(ql.__dict__[x] for x in ql.__all__)) or super().is_leaf_module(m, qualname)
+
+    graph = QuantTracer().trace(model)
+    modules = dict(model.named_modules())
+
+    calls = {}
+    for node in graph.nodes:
+        if node.op == 'call_module':
+            calls[node.target] = calls.get(node.target, 0) + 1
+
+    def is_relu(node):
+        if node.op == 'call_module':
+            return isinstance(modules[node.target], RELUS)
+        return node.op == 'call_function' and node.target in RELU_FUNCTIONS
+
+    chains = []
+    for node in graph.nodes:
+        if not is_relu(node) or len(node.args) == 0:
+            continue
+        bnNode = node.args[0]
+        if not isinstance(bnNode, torch.fx.Node) or bnNode.op != 'call_module' or len(bnNode.users) != 1 or calls[bnNode.target] != 1:
+            continue
+        convNode = bnNode.args[0]
+        if not isinstance(convNode, torch.fx.Node) or convNode.op != 'call_module' or len(convNode.users) != 1 or calls[convNode.target] != 1:
+            continue
+        if not fusable(modules[convNode.target], modules[bnNode.target]):
+            continue
+
+        relu6 = isinstance(modules.get(node.target), nn.ReLU6) or node.target is F.relu6
+        # shared activation modules stay in place, applying them again to the block output is a no-op
+        reluName = node.target if node.op == 'call_module' and calls[node.target] == 1 else None
+        chains.append((convNode.target, bnNode.target, reluName, relu6))
+
+    return chains
+
+def find_chains_sequential(model):
+    # fallback for untraceable models, consecutive children of nn.Sequential containers
+    chains = []
+    for name, module in model.named_modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        children = list(module._modules.items())
+        for i in range(len(children) - 2):
+            (convName, conv), (bnName, bn), (reluName, relu) = children[i:i+3]
+            if fusable(conv, bn) and isinstance(relu, RELUS):
+                prefix = name + '.' if name != '' else ''
+                chains.append((prefix + convName, prefix + bnName, prefix + reluName, isinstance(relu, nn.ReLU6)))
+    return chains
+
+def fuse_conv_bn_relu(model):
+    # replace every QuantConv2d -> BatchNorm2d -> ReLU chain by a QuantConvBNReLU block in place
+    if not fx_available():
+        print('==> torch.fx is not available, fusing nn.Sequential blocks only')
+        chains = find_chains_sequential(model)
+    else:
+        try:
+            chains = find_chains_traced(model)
+        except Exception as e:
+            print('==> Could not trace {} ({}), fusing nn.Sequential blocks only'.format(model.__class__.__name__, e))
+            chains = find_chains_sequential(model)
+
+    for convName, bnName, reluName, relu6 in chains:
+        fused = ql.QuantConvBNReLU(get_module(model, convName), get_module(model, bnName), relu6)
+        set_module(model, convName, fused)
+        set_module(model, bnName, nn.Identity())
+        if reluName is not None:
+            set_module(model, reluName, nn.Identity())
+
+    print('==> Fused {} Conv-BN-ReLU blocks'.format(len(chains)))
+    return model
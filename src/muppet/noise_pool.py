@@ -0,0 +1,66 @@
+import torch
+
+class NoisePool(object):
+    """Provider of uniform(-0.5, 0.5) noise for stochastic rounding.
+
+    A buffer per device and dtype is filled with a single RNG launch and handed
+    out in consecutive slices, so no slice is ever reused before the buffer is
+    refilled. Refills allocate a new buffer, so slices that autograd still holds
+    are never overwritten. Each pool owns a generator seeded from the run's
+    Manual_Seed, which makes the noise reproducible for a given sequence of calls.
+    """
+    def __init__(self, seed=None, poolSize=1<<22):
+        self.seed = seed
+        self.poolSize = poolSize
+        self.pools = {}
+
+    def generator(self, device):
+        # generators on the device need torch 1.5 or later, older versions draw the noise on the host with a
+        # CPU generator, or with the default generator seeded from Manual_Seed if there is no Generator class
+        try:
+            generator, fillDevice = torch.Generator(device=device), device
+        except (TypeError, RuntimeError):
+            try:
+                generator, fillDevice = torch.Generator(), torch.device('cpu')
+            except (TypeError, RuntimeError, AttributeError):
+                return None, torch.device('cpu')
+
+        if self.seed is None:
+            generator.seed()
+        else:
+            generator.manual_seed(self.seed)
+        return generator, fillDevice
+
+    def fill(self, pool, numel, device, dtype):
+        # always a new buffer, slices handed out earlier may still be saved for backward
+        buffer = torch.empty(numel, device=pool['fillDevice'], dtype=dtype)
+        if pool['generator'] is None:
+            buffer.uniform_(-0.5, 0.5)
+        else:
+            buffer.uniform_(-0.5, 0.5, generator=pool['generator'])
+        return buffer.to(device)
+
+    def setup_pool(self, device, dtype, numel):
+        generator, fillDevice = self.generator(device)
+        pool = {'offset': 0, 'generator': generator, 'fillDevice': fillDevice}
+        pool['buffer'] = self.fill(pool, max(self.poolSize, numel), device, dtype)
+        self.pools[(device, dtype)] = pool
+
+    def get(self, size, device, dtype=torch.float32):
+        numel = 1
+        for dim in size:
+            numel *= dim
+
+        if (device, dtype) not in self.pools:
+            self.setup_pool(device, dtype, numel)
+        pool = self.pools[(device, dtype)]
+
+        if pool['offset'] + numel > pool['buffer'].numel():
+            # a fresh buffer in one launch, grown if a single request no longer fits
+            pool['buffer'] = self.fill(pool, max(pool['buffer'].numel(), numel), device, dtype)
+            pool['offset'] = 0
+
+        noise = pool['buffer'][pool['offset']:pool['offset'] + numel].view(size)
+        pool['offset'] += numel
+
+        return noise
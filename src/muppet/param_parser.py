@@ -17,8 +17,29 @@ class Params(ppSrc.Params):
         self.bitWidth = config_file.getint('muppet_hyperparameters', 'bit_width')
         self.dataType = config_file.get('muppet_hyperparameters', 'data_type')
         self.roundMeth = config_file.get('muppet_hyperparameters', 'round_meth')
+        self.syncFree = config_file.getboolean('muppet_hyperparameters', 'sync_free', fallback=False)
+        self.sfRefreshInterval = config_file.getint('muppet_hyperparameters', 'sf_refresh_interval', fallback=1)
+        self.sfSatThreshold = config_file.getfloat('muppet_hyperparameters', 'sf_saturation_threshold', fallback=0.01)
+        self.intStorage = config_file.getboolean('muppet_hyperparameters', 'int_storage', fallback=False)
+        self.telemetryPath = config_file.get('muppet_hyperparameters', 'telemetry_path', fallback='')
+        self.telemetrySampleRate = config_file.getfloat('muppet_hyperparameters', 'telemetry_sample_rate', fallback=1.0)
+        self.fuseConvBN = config_file.getboolean('muppet_hyperparameters', 'fuse_conv_bn_relu', fallback=False)
+        self.masterCopy = config_file.get('muppet_hyperparameters', 'master_copy', fallback='Device')
+        self.masterChunk = config_file.getint('muppet_hyperparameters', 'master_copy_chunk', fallback=1<<24)
+        self.inputQuantization = config_file.get('muppet_hyperparameters', 'input_quantization', fallback='Device')
+        assert self.inputQuantization in ('Device', 'Loader'), 'Input_Quantization should be one of Device or Loader'
+        self.flatBuffers = config_file.getboolean('muppet_hyperparameters', 'flat_buffers', fallback=False)
+        self.momentBitWidth = config_file.getint('muppet_hyperparameters', 'moment_bit_width', fallback=16)
+        self.fusedStep = config_file.getboolean('muppet_hyperparameters', 'fused_optimizer', fallback=False)
+        assert self.flatBuffers or not self.fusedStep, 'Fused_Optimizer works on the flat buffers enabled by Flat_Buffers'
+        self.perLayerPrecision = config_file.getboolean('muppet_hyperparameters', 'per_layer_precision', fallback=False)
         self.policyResolution = config_file.getint('muppet_hyperparameters', 'policy_resolution')
         self.policyPatience = config_file.getint('muppet_hyperparameters', 'policy_patience')
+        self.gdInterval = config_file.getint('muppet_hyperparameters', 'gd_accumulation_interval', fallback=0)
+        self.gdRecordPath = config_file.get('muppet_hyperparameters', 'gd_record_path', fallback='')
+        self.gdRecordWindow = config_file.getint('muppet_hyperparameters', 'gd_record_window', fallback=8)
+        self.thresholdScale = config_file.getfloat('muppet_hyperparameters', 'threshold_scale', fallback=1.5)
+        self.thresholdDecay = config_file.getfloat('muppet_hyperparameters', 'threshold_decay', fallback=0.1)
         self.fp32EpochsPerLR = config_file.getint('muppet_hyperparameters', 'fp32_epochs_per_lr')
         self.precEpochSchedule = config_file.get('muppet_hyperparameters', 'prec_epoch_schedule', fallback = 'undefined')
         self.pruningParams = config_file.get('pruning_params') if 'pruning_params' in config_file.sections() else None
@@ -36,6 +57,7 @@ class Params(ppSrc.Params):
             else:
                 self.precEpochSchedule = [int(x) for x in self.precEpochSchedule.split()]
                 assert len(self.precEpochSchedule) == len(self.precSchedule)-1, 'Number of precision switching points ({}) does not match the number of precisions-1 ({})'.format(len(self.precEpochSchedule), len(self.precSchedule))
+                assert not self.perLayerPrecision, 'per layer precision switching is driven by gradient diversity and cannot follow a precision epoch schedule'
                     
 
         if self.dataType == "Float":
@@ -48,6 +70,11 @@ class Params(ppSrc.Params):
         self.sumOfGrads = {}
         self.quantised = (self.bitWidth != 'Float')
         self.threshold = -1
+        self.siteStates = {}
+        self.siteBitWidths = {}
+        self.avgBitWidth = 0
+        self.runAvgBitWidth = 0
+        self.bitWidthEpochs = 0
         
 def parse_command_line_args() : 
     parser = argparse.ArgumentParser(description='PyTorch Pruning')
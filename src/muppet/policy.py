@@ -2,6 +2,134 @@ import sys
 import math
 import torch
 import time
+import numpy as np
+
+def fold_into(sumOfGrads, sumOfNorms, segIds, parts):
+    # add consecutive pieces of the flat gradient to the sums, the squared norm of every parameter in one reduction per piece
+    start = 0
+    for part in parts:
+        end = start + part.numel()
+        sumOfGrads[start:end].add_(part)
+        sumOfNorms.index_add_(0, segIds[start:end], part * part)
+        start = end
+
+def flat_order(named, optimiser):
+    # parameters in the order of the optimizer's flat gradient buffers and those buffers, None if it has none
+    flatGroups = getattr(optimiser, 'flatGroups', None)
+    if flatGroups is None:
+        return None, None
+
+    names = {id(p): n for n, p in named}
+    order = []
+    buffers = []
+    for group, flats in zip(optimiser.param_groups, flatGroups):
+        for flat in flats:
+            order += [group['params'][i] for i in flat.idx]
+            buffers.append(flat.grad)
+    if len(order) != len(named) or any(id(p) not in names for p in order):
+        return None, None
+    return [(names[id(p)], p) for p in order], buffers
+
+class GDAccumulator(object):
+    # running squared gradient norms and gradient sums of every parameter, kept in flat buffers on the device
+    # if the optimizer keeps flat gradient buffers the parameters are taken in their order and the buffers are folded in place
+    def __init__(self, model, params, optimiser=None):
+        named = list(model.named_parameters())
+        ordered, self.buffers = flat_order(named, optimiser)
+        if ordered is not None:
+            named = ordered
+        self.names = [n for n, _ in named]
+        self.weights = [p for _, p in named]
+        self.lengths = [p.numel() for p in self.weights]
+        self.params = params
+
+        device = self.weights[0].device
+        self.segIds = torch.repeat_interleave(torch.arange(len(self.lengths), device=device), torch.tensor(self.lengths, device=device))
+
+        # sums of a resumed run are stored in the checkpointed state
+        if torch.is_tensor(params.sumOfGrads) and params.sumOfGrads.numel() == self.segIds.numel():
+            self.sumOfGrads = params.sumOfGrads.to(device)
+            self.sumOfNorms = params.sumOfNorms.to(device)
+            self.folds = 1
+            self.share()
+        else:
+            self.reset()
+
+    def share(self):
+        # the checkpointed state refers to the running sums
+        self.params.sumOfNorms = self.sumOfNorms
+        self.params.sumOfGrads = self.sumOfGrads
+
+    def reset(self):
+        device = self.weights[0].device
+        self.sumOfGrads = torch.zeros(sum(self.lengths), device=device)
+        self.sumOfNorms = torch.zeros(len(self.lengths), device=device)
+        # folds since the last reset, a diversity over none of them would be 0/0
+        self.folds = 0
+        self.share()
+
+    def gradients(self):
+        # the flat gradient as consecutive pieces, gathered into a new buffer only without flat optimizer buffers
+        if self.buffers is not None:
+            return self.buffers
+        return [torch.cat([(p.grad.data if p.grad is not None else torch.zeros_like(p.data)).reshape(-1) for p in self.weights])]
+
+    def add(self):
+        parts = self.gradients()
+        fold_into(self.sumOfGrads, self.sumOfNorms, self.segIds, parts)
+        self.folds += 1
+        return parts
+
+    def diversity(self):
+        # per parameter ratio of the summed squared norms to the squared norm of the summed gradients
+        gradNorms = torch.zeros_like(self.sumOfNorms).index_add_(0, self.segIds, self.sumOfGrads * self.sumOfGrads)
+        return self.sumOfNorms / gradNorms
+
+class GDRecorder(object):
+    # per epoch gradient statistics of every parameter, enough to replay the policy offline (see simulate_policy.py)
+    # ||sum of gradients||^2 over a window of epochs is rebuilt from the dot products of each epoch's gradient sum
+    # with those of the previous window-1 epochs, which are kept on the device
+    def __init__(self, path, window, accumulator, params):
+        self.path = path
+        self.window = window
+        self.accumulator = accumulator
+        self.params = params
+        self.history = []
+        self.rows = {'epoch': [], 'bitWidth': [], 'norms': [], 'dots': []}
+        self.reset()
+
+    def reset(self):
+        self.grads = torch.zeros_like(self.accumulator.sumOfGrads)
+        self.norms = torch.zeros_like(self.accumulator.sumOfNorms)
+        self.folds = 0
+
+    def add(self, parts):
+        fold_into(self.grads, self.norms, self.accumulator.segIds, parts)
+        self.folds += 1
+
+    def end_epoch(self, epoch):
+        if self.folds == 0:
+            return
+
+        segIds = self.accumulator.segIds
+        dots = torch.zeros(self.window, self.norms.numel(), device=self.norms.device)
+        for lag, prev in enumerate([self.grads] + self.history):
+            dots[lag].index_add_(0, segIds, self.grads * prev)
+
+        self.rows['epoch'].append(epoch)
+        self.rows['bitWidth'].append(self.params.bitWidth)
+        self.rows['norms'].append(self.norms.cpu().numpy())
+        self.rows['dots'].append(dots.cpu().numpy())
+
+        self.history = ([self.grads] + self.history)[:self.window-1]
+        self.reset()
+        self.save()
+
+    def save(self):
+        # rewritten every epoch so that an interrupted run keeps its statistics
+        np.savez(self.path, names=np.array(self.accumulator.names), precSchedule=np.array(self.params.precSchedule), \
+                 epoch=np.array(self.rows['epoch']), bitWidth=np.array(self.rows['bitWidth']), \
+                 norms=np.stack(self.rows['norms']), dots=np.stack(self.rows['dots']))
 
 class Policy(object):
     def __init__(self, params):
@@ -9,38 +137,73 @@ class Policy(object):
         self.threshold = self._threshold()
         self.fp32Count = 0
         self.precIndex = 0
+        self.accumulator = None
+        self.recorder = None
 
     def _threshold(self):
-        return [1 + 1.5*math.exp(-0.1*x) for x in range(self.params.epochs)]
+        return [1 + self.params.thresholdScale*math.exp(-self.params.thresholdDecay*x) for x in range(self.params.epochs)]
 
-    def update_calculation(self, layer):
-        layerName = layer[0]
-        layerGrad = layer[1].grad.data
+    def fold(self, model, optimiser=None):
+        if self.accumulator is None:
+            self.accumulator = GDAccumulator(model, self.params, optimiser)
+            if self.params.gdRecordPath != '':
+                self.recorder = GDRecorder(self.params.gdRecordPath, self.params.gdRecordWindow, self.accumulator, self.params)
 
-        gradNorm = torch.pow(torch.norm(layerGrad,2),2)
-        if layerName in self.params.sumOfNorms:
-            self.params.sumOfNorms[layerName].add_(gradNorm)
-        else:
-            self.params.sumOfNorms[layerName] = gradNorm
+        parts = self.accumulator.add()
+        if self.recorder is not None:
+            self.recorder.add(parts)
 
-        if layerName in self.params.sumOfGrads:
-            self.params.sumOfGrads[layerName].add_(layerGrad)
-        else:
-            self.params.sumOfGrads[layerName] = layerGrad
+    def end_epoch(self, epoch):
+        if self.recorder is not None:
+            self.recorder.end_epoch(epoch)
+
+    def update(self, model, optimiser=None):
+        # with a streaming accumulator the gradients were already folded in during the epoch
+        if self.params.gdInterval > 0:
+            return
+        self.fold(model, optimiser)
 
-    def update(self, model):
-        for param in model.named_parameters():
-            self.update_calculation(param)
+    def accumulate(self, model, batchIdx, optimiser=None):
+        # fold the gradients of every k-th batch into the streaming accumulator
+        if self.params.gdInterval <= 0 or (batchIdx+1) % self.params.gdInterval != 0:
+            return
+        if self.params.dataType == 'Float' or self.params.precEpochSchedule != []:
+            return
+        self.fold(model, optimiser)
+
+    def folded(self, tqdm):
+        # a check without any gradients folded since the last one is skipped rather than comparing NaNs
+        if self.accumulator is None or self.accumulator.folds == 0:
+            tqdm.write("No gradients accumulated since the last policy check, skipping it")
+            return False
+        return True
 
     def calculate_mean_gd(self):
-        self.params.meanGD = 0
-        numGD = 0
-        for layer, val in self.params.sumOfGrads.items():
-            self.params.meanGD += (self.params.sumOfNorms[layer] / torch.pow(torch.norm(self.params.sumOfGrads[layer],2),2))
-            numGD += 1
-        self.params.meanGD = self.params.meanGD / numGD
-        self.params.sumOfNorms = {}
-        self.params.sumOfGrads = {}
+        self.params.meanGD = self.accumulator.diversity().mean()
+        self.accumulator.reset()
+
+    def calculate_site_gd(self, sites):
+        # mean gradient diversity of the parameters owned by each quantized layer
+        gd = self.accumulator.diversity()
+        self.accumulator.reset()
+
+        index = {n: i for i, n in enumerate(self.accumulator.names)}
+        names = []
+        owned = []
+        for site in sites:
+            idx = [index[n] for n in site.paramNames if n in index]
+            if idx != []:
+                names.append(site.name)
+                owned.append(idx)
+        if names == []:
+            return {}
+
+        counts = torch.tensor([len(idx) for idx in owned], device=gd.device)
+        siteIds = torch.repeat_interleave(torch.arange(len(owned), device=gd.device), counts)
+        siteGD = torch.zeros(len(owned), device=gd.device).index_add_(0, siteIds, gd[torch.tensor(sum(owned, []), device=gd.device)]) / counts
+
+        # a single transfer for the whole model
+        return dict(zip(names, siteGD.tolist()))
 
     # check if policy has been violated
     def check_violation(self, epoch, tqdm, cp): 
@@ -49,6 +212,9 @@ class Policy(object):
             if ((epoch+1) % self.params.policyResolution) != 0 or self.params.dataType == 'Float':
                 return False 
 
+            if not self.folded(tqdm):
+                return False
+
             self.calculate_mean_gd()
             
             if self.params.meanGD >= self.params.maxGD:
@@ -73,13 +239,9 @@ class Policy(object):
                 return False
     
     def copy_fp32_model(self, optimiser):
-        for group in optimiser.param_groups:
-            fpWeights = group['fpWeights']
-            weights = group['params']
-            for i in range(len(weights)):
-                weights[i].data = fpWeights[i].data
+        optimiser.release_master()
         
-    def change_precision(self, scaler, model, optimiser):
+    def advance_precision(self):
     #{{{
         self.precIndex += 1 
         self.params.bitWidth = self.params.precSchedule[self.precIndex]
@@ -88,11 +250,101 @@ class Policy(object):
         # check to see if it is the final precision change to FP32
         if self.params.bitWidth == -1:
             self.params.dataType = 'Float'
+            return True
+        return False
+    #}}}
+
+    def change_precision(self, scaler, model, optimiser):
+    #{{{
+        if self.advance_precision():
             self.copy_fp32_model(optimiser)
 
         scaler.update_model_precision(model)
     #}}}
 
+    def setup_layers(self, scaler, optimiser):
+    #{{{
+        # a fresh run starts every layer at the first precision, a resumed run restores the saved states
+        for site in scaler.sites:
+            self.params.siteStates.setdefault(site.name, {'precIndex': 0, 'maxGD': 0, 'gdViolations': 0})
+
+        if self.params.dataType != 'Float':
+            self.apply_layer_precisions(scaler, optimiser)
+    #}}}
+
+    # check if the policy has been violated for each layer, and raise the precision of the violating layers
+    def check_layer_violations(self, epoch, tqdm, scaler, optimiser):
+    #{{{
+        if ((epoch+1) % self.params.policyResolution) != 0 or self.params.dataType == 'Float':
+            return False
+
+        if not self.folded(tqdm):
+            return False
+
+        siteGD = self.calculate_site_gd(scaler.sites)
+        self.params.threshold = self.threshold[epoch]
+
+        changed = []
+        for site in scaler.sites:
+            if site.name not in siteGD or site.bitWidth == -1:
+                continue
+
+            state = self.params.siteStates[site.name]
+            meanGD = siteGD[site.name]
+            if meanGD >= state['maxGD']:
+                state['maxGD'] = meanGD
+            elif (state['maxGD'] / meanGD) > self.threshold[epoch]:
+                state['gdViolations'] += 1
+
+            if state['gdViolations'] >= self.params.policyPatience:
+                state['gdViolations'] = 0
+                state['maxGD'] = 0
+                state['precIndex'] += 1
+                changed.append(site.name)
+
+        tqdm.write("threshold = {}, gdViolations = {}".format(self.threshold[epoch], {k: v['gdViolations'] for k, v in self.params.siteStates.items()}))
+
+        if changed == []:
+            return False
+
+        self.apply_layer_precisions(scaler, optimiser)
+        tqdm.write("precision raised for {}".format(', '.join(changed)))
+        return True
+    #}}}
+
+    def apply_layer_precisions(self, scaler, optimiser):
+    #{{{
+        bitWidths = {}
+        for site in scaler.sites:
+            site.bitWidth = self.params.precSchedule[self.params.siteStates[site.name]['precIndex']]
+            for p in site.module.parameters():
+                bitWidths[p] = site.bitWidth
+
+        quantised = [site.bitWidth for site in scaler.sites if site.bitWidth != -1]
+        if quantised == []:
+            self.params.bitWidth = -1
+            self.params.dataType = 'Float'
+            self.copy_fp32_model(optimiser)
+            optimiser.set_bit_widths(None)
+            return
+
+        # inputs and layers that are not quantized sites follow the lowest precision still in use
+        self.params.bitWidth = min(quantised)
+
+        # layers that reached FP32 train directly on their master copy
+        optimiser.release_master(set(p for p, bitWidth in bitWidths.items() if bitWidth == -1))
+
+        optimiser.set_bit_widths(bitWidths)
+    #}}}
+
+    def record_bit_width(self, scaler):
+        # parameter weighted bit width of the epoch, layers in FP32 count as 32 bits
+        numel = sum(site.numel for site in scaler.sites)
+        bits = sum((32 if site.bitWidth == -1 else site.bitWidth) * site.numel for site in scaler.sites)
+        self.params.avgBitWidth = bits / max(numel, 1)
+        self.params.bitWidthEpochs += 1
+        self.params.runAvgBitWidth += (self.params.avgBitWidth - self.params.runAvgBitWidth) / self.params.bitWidthEpochs
+
     def check_stopping_condition(self, optimiser):
     #{{{
         if self.params.dataType == 'Float':
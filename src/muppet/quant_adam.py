@@ -0,0 +1,60 @@
+import math
+import torch
+import src.muppet.int_storage as int_storage
+import src.muppet.quant_optimizer as quant_optimizer
+from torch.optim.optimizer import required
+
+
+class QuantAdam(quant_optimizer.QuantOptimizer):
+    # Adam, or AdamW if decoupled is set, on the FP32 master weights of quantized parameters
+    # the first moment is held in dynamic fixed point and the root of the second moment in FP16
+    # when momentBitWidth is set, the root keeps the small second moments fixed point would flush to zero
+    def __init__(self, params, _quantizer, lr=required, betas=(0.9, 0.999), eps=1e-8, weight_decay=0, decoupled=False, masterCopy='Device', masterChunk=1<<24, momentBitWidth=-1):
+        if lr is not required and lr < 0.0:
+            raise ValueError("Invalid learning rate: {}".format(lr))
+        if eps < 0.0:
+            raise ValueError("Invalid epsilon value: {}".format(eps))
+        if not 0.0 <= betas[0] < 1.0 or not 0.0 <= betas[1] < 1.0:
+            raise ValueError("Invalid beta parameters: {}".format(betas))
+        if weight_decay < 0.0:
+            raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, decoupled=decoupled)
+        super(QuantAdam, self).__init__(params, _quantizer, defaults, masterCopy, masterChunk, momentBitWidth)
+
+    def update_param(self, group, p, fp):
+        beta1, beta2 = group['betas']
+        weight_decay = group['weight_decay']
+        lr = group['lr']
+
+        state = self.state[p]
+        state['step'] = state.get('step', 0) + 1
+        grad = p.grad.data
+
+        if weight_decay != 0:
+            if group['decoupled']:
+                fp.mul_(1 - lr * weight_decay)
+            else:
+                grad = grad.add(int_storage.value_of(p), alpha=weight_decay)
+
+        exp_avg = self.moment(p, 'exp_avg')
+        exp_avg_sq = self.second_moment(p)
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+        bias_correction1 = 1 - beta1 ** state['step']
+        bias_correction2 = 1 - beta2 ** state['step']
+        denom = (exp_avg_sq.sqrt() / math.sqrt(bias_correction2)).add_(group['eps'])
+        fp.addcdiv_(exp_avg, denom, value=-lr / bias_correction1)
+
+        self.save_moment(p, 'exp_avg', exp_avg)
+        if self.momentBitWidth == -1:
+            state['exp_avg_sq'] = exp_avg_sq
+        else:
+            state['exp_avg_sq_root'] = exp_avg_sq.sqrt().half()
+
+    def second_moment(self, p):
+        state = self.state[p]
+        if 'exp_avg_sq_root' in state:
+            return state['exp_avg_sq_root'].float().pow_(2)
+        return self.moment(p, 'exp_avg_sq')
@@ -0,0 +1,42 @@
+import torch
+import src.muppet.int_storage as int_storage
+import src.muppet.quant_optimizer as quant_optimizer
+from torch.optim.optimizer import required
+
+
+class QuantLARS(quant_optimizer.QuantOptimizer):
+    # SGD with momentum and a layer wise learning rate scaled by ||w|| / (||g|| + weight_decay*||w||)
+    # the norms are taken on the quantized weights and gradients, as the weight decay of QuantSGD is
+    def __init__(self, params, _quantizer, lr=required, momentum=0, weight_decay=0, trustCoefficient=0.001, masterCopy='Device', masterChunk=1<<24, momentBitWidth=-1):
+        if lr is not required and lr < 0.0:
+            raise ValueError("Invalid learning rate: {}".format(lr))
+        if momentum < 0.0:
+            raise ValueError("Invalid momentum value: {}".format(momentum))
+        if weight_decay < 0.0:
+            raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+        if trustCoefficient <= 0.0:
+            raise ValueError("Invalid trust coefficient: {}".format(trustCoefficient))
+
+        defaults = dict(lr=lr, momentum=momentum, weight_decay=weight_decay, trustCoefficient=trustCoefficient)
+        super(QuantLARS, self).__init__(params, _quantizer, defaults, masterCopy, masterChunk, momentBitWidth)
+
+    def update_param(self, group, p, fp):
+        weight_decay = group['weight_decay']
+        momentum = group['momentum']
+
+        weight = int_storage.value_of(p)
+        grad = p.grad.data
+        weightNorm = torch.norm(weight)
+        gradNorm = torch.norm(grad)
+
+        # the trust ratio stays on the device, layers with a zero weight or gradient norm use the global rate
+        trust = group['trustCoefficient'] * weightNorm / (gradNorm + weight_decay * weightNorm)
+        trust = torch.where((weightNorm > 0) & (gradNorm > 0), trust, torch.ones_like(trust))
+
+        d_p = grad.add(weight, alpha=weight_decay).mul_(trust)
+        if momentum != 0:
+            buf = self.moment(p, 'momentum_buffer').mul_(momentum).add_(d_p)
+            self.save_moment(p, 'momentum_buffer', buf)
+            d_p = buf
+
+        fp.add_(d_p, alpha=-group['lr'])
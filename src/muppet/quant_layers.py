@@ -1,10 +1,13 @@
 import torch.nn as nn
+import torch.nn.functional as F
 import torch
 import sys
+import math
 import src.muppet.quantize as quantize
+import src.muppet.int_storage as int_storage
 
 
-__all__ = ['QuantConv2d', 'QuantLinear', 'QuantAvgPool2d', 'QuantAdaptiveAvgPool2d']
+__all__ = ['QuantConv2d', 'QuantLinear', 'QuantAvgPool2d', 'QuantAdaptiveAvgPool2d', 'QuantConvBNReLU']
 class QuantConv2d(nn.Conv2d):
     def __init__(self, in_channels, out_channels, kernel_size, stride=1, padding=0, dilation=1, groups=1, bias=True, padding_mode='zeros', _bitWidth=8, _SFHolder=None):
 
@@ -12,6 +15,8 @@ class QuantConv2d(nn.Conv2d):
         self.sfHolder = _SFHolder
         self.prevLayer = None
         self.weightSF = 0
+        self.siteName = None
+        self.outputSF = 0
 
         super(QuantConv2d, self).__init__(in_channels, out_channels, kernel_size, stride, padding, dilation, groups, bias)
 
@@ -19,9 +24,17 @@ class QuantConv2d(nn.Conv2d):
         self.quantizer = quantizer
 
     def forward(self, input):
-        result = super().forward(input)
+        result = F.conv2d(input, int_storage.weight_of(self.weight), self.bias, self.stride, self.padding, self.dilation, self.groups)
         return forward(self, result, "Conv2d")
 
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        super()._save_to_state_dict(destination, prefix, keep_vars)
+        int_storage.save_to_state_dict(self, destination, prefix)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        int_storage.decompress(self.weight)
+        super()._load_from_state_dict(*args, **kwargs)
+
 class QuantLinear(nn.Linear):
     def __init__(self, in_features, out_features, bias=True, _bitWidth=8, _SFHolder=None):
 
@@ -29,6 +42,8 @@ class QuantLinear(nn.Linear):
         self.sfHolder = _SFHolder
         self.prevLayer = None
         self.weightSF = 0
+        self.siteName = None
+        self.outputSF = 0
 
         super(QuantLinear, self).__init__(in_features, out_features, bias)
     
@@ -36,9 +51,17 @@ class QuantLinear(nn.Linear):
         self.quantizer = quantizer
 
     def forward(self, input):
-        result = super().forward(input)
+        result = F.linear(input, int_storage.weight_of(self.weight), self.bias)
         return forward(self, result, "Linear")
 
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        super()._save_to_state_dict(destination, prefix, keep_vars)
+        int_storage.save_to_state_dict(self, destination, prefix)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        int_storage.decompress(self.weight)
+        super()._load_from_state_dict(*args, **kwargs)
+
 class QuantAvgPool2d(nn.AvgPool2d):
     def __init__(self, kernel_size, stride=None, padding=0, ceil_mode=False, count_include_pad=True, _bitWidth=8, _SFHolder=None):
 
@@ -46,6 +69,8 @@ class QuantAvgPool2d(nn.AvgPool2d):
         self.sfHolder = _SFHolder
         self.prevLayer = None
         self.weightSF = 0
+        self.siteName = None
+        self.outputSF = 0
 
         super(QuantAvgPool2d, self).__init__(kernel_size, stride, padding, ceil_mode, count_include_pad)
     
@@ -63,6 +88,8 @@ class QuantAdaptiveAvgPool2d(nn.AdaptiveAvgPool2d):
         self.sfHolder = _SFHolder
         self.prevLayer = None
         self.weightSF = 0
+        self.siteName = None
+        self.outputSF = 0
 
         super(QuantAdaptiveAvgPool2d, self).__init__(output_size)
     
@@ -73,12 +100,145 @@ class QuantAdaptiveAvgPool2d(nn.AdaptiveAvgPool2d):
         result = super().forward(input)
         return forward(self, result, "AdaptiveAvgPool2d")
 
+class QuantConvBNReLU(QuantConv2d):
+    # QuantConv2d, BatchNorm2d and ReLU (or ReLU6) as one block whose quantized output is the
+    # activation. In training, batch norm, the activation and quantization are one elementwise
+    # pass, in eval the batch norm is folded into the convolution. Built from existing modules,
+    # sharing their parameters, by model_surgery.fuse_conv_bn_relu
+    def __init__(self, conv, bn, relu6=False):
+        super(QuantConvBNReLU, self).__init__(conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride, conv.padding, conv.dilation, conv.groups, conv.bias is not None, _bitWidth=conv.bitWidth)
+
+        self.weight = conv.weight
+        self.bias = conv.bias
+        self.bn = bn
+        self.upper = 6.0 if relu6 else math.inf
+
+    def forward(self, input):
+        weight = int_storage.weight_of(self.weight)
+
+        if not self.training:
+            weight, bias = self.fold_bn(weight)
+            result = F.conv2d(input, weight, bias, self.stride, self.padding, self.dilation, self.groups)
+            return forward(self, torch.clamp(result, 0, self.upper), "ConvBNReLU")
+
+        result = F.conv2d(input, weight, self.bias, self.stride, self.padding, self.dilation, self.groups)
+        if self.bitWidth == -1:
+            return torch.clamp(self.bn(result), 0, self.upper)
+
+        result = BNReLUQuantizeFunction.apply(result, self.bn.weight, self.bn.bias, self)
+        if self.quantizer.intStorage:
+            int_storage.tag(result, self.outputSF, self.bitWidth)
+        return result
+
+    def fold_bn(self, weight):
+        bn = self.bn
+        a = bn.weight * torch.rsqrt(bn.running_var + bn.eps)
+        bias = self.bias if self.bias is not None else torch.zeros_like(bn.running_mean)
+        return weight * a.view(-1, 1, 1, 1), (bias - bn.running_mean) * a + bn.bias
+
+class BNReLUQuantizeFunction(torch.autograd.Function):
+    # training time batch norm, activation and quantization of a QuantConvBNReLU block
+    # the quantization exponent is derived from the per channel extremes of the conv
+    # output, so the activation is written once, already quantized
+    @staticmethod
+    def forward(ctx, x, gamma, beta, layer):
+        bn = layer.bn
+        n = x.numel() // x.size(1)
+
+        # per channel statistics over a channel major view, with reductions that older torch versions have too
+        channels = x.transpose(0, 1).reshape(x.size(1), -1)
+        mean = channels.mean(1)
+        var = channels.var(1, unbiased=False)
+        invStd = torch.rsqrt(var + bn.eps)
+        a = gamma * invStd
+        b = beta - mean * a
+
+        if bn.training and bn.track_running_stats:
+            bn.num_batches_tracked.add_(1)
+            factor = bn.momentum if bn.momentum is not None else 1.0 / float(bn.num_batches_tracked)
+            bn.running_mean.mul_(1 - factor).add_(mean * factor)
+            bn.running_var.mul_(1 - factor).add_(var * (factor * n / max(n - 1, 1)))
+
+        # the affine map is monotonic per channel, so the output extremes follow from the input ones
+        xMax, xMin = channels.max(1)[0], channels.min(1)[0]
+        yA, yB = a * xMax + b, a * xMin + b
+        yMax = torch.clamp(torch.max(yA, yB).max(), 0, layer.upper)
+        yMin = torch.clamp(torch.min(yA, yB).min(), 0, layer.upper)
+
+        quantizer = layer.quantizer
+        sf = quantizer.range_exponent(yMin, yMax, layer.bitWidth)
+        scale, invScale = torch.pow(2.0, sf), torch.pow(2.0, -sf)
+
+        shape = (1, -1, 1, 1)
+        if quantizer.roundMeth == 'Simple':
+            quantized = quantize._bn_act_round(x, a.view(shape), b.view(shape), 0.0, layer.upper, scale, invScale)
+        else:
+            noise = quantizer.noise.get(x.size(), x.device, x.dtype)
+            quantized = quantize._bn_act_stoch_round(x, noise, a.view(shape), b.view(shape), 0.0, layer.upper, scale, invScale)
+        layer.outputSF = sf
+
+        ctx.layer = layer
+        ctx.save_for_backward(x, gamma, mean, invStd, a, b)
+        return quantized
+
+    @staticmethod
+    def backward(ctx, grad):
+        layer = ctx.layer
+        x, gamma, mean, invStd, a, b = ctx.saved_tensors
+        dims = (0, 2, 3)
+        shape = (1, -1, 1, 1)
+        n = x.numel() // x.size(1)
+
+        grad, _ = layer.quantizer.quantize_inputs(grad, layer.bitWidth, "backward-{}".format(layer.siteName))
+
+        # activation backward, from the pre-activation values recomputed from x
+        z = x * a.view(shape) + b.view(shape)
+        grad = grad * ((z > 0) & (z < layer.upper)).to(grad.dtype)
+
+        xHat = (x - mean.view(shape)) * invStd.view(shape)
+        gradBeta = grad.sum(dims)
+        gradGamma = (grad * xHat).sum(dims)
+        gradX = (gamma * invStd / n).view(shape) * (n * grad - gradBeta.view(shape) - xHat * gradGamma.view(shape))
+
+        return gradX, gradGamma, gradBeta, None
+
+class QuantizeFunction(torch.autograd.Function):
+    # quantizes the output of a layer in forward and the gradient flowing into it in backward
+    @staticmethod
+    def forward(ctx, result, layer):
+        ctx.layer = layer
+        quantized, layer.outputSF = layer.quantizer.quantize_inputs(result, layer.bitWidth, "forward-{}".format(layer.siteName))
+        return quantized
+
+    @staticmethod
+    def backward(ctx, grad):
+        layer = ctx.layer
+        if layer.bitWidth != -1:
+            grad, _ = layer.quantizer.quantize_inputs(grad, layer.bitWidth, "backward-{}".format(layer.siteName))
+        return grad, None
+
 # modified forward that quantizes the result produced by the layer
 def forward(self, result, spec):
     if self.bitWidth != -1:
-        result.data, sf = self.quantizer.quantize_inputs(result.data, self.bitWidth, "forward-{}".format(spec))
+        result = QuantizeFunction.apply(result, self)
+        if self.quantizer.intStorage:
+            int_storage.tag(result, self.outputSF, self.bitWidth)
     return result
 
+# build a Quant layer around the parameters and buffers of an FP32 layer, without copying them
+def from_float(module, quantClass, bitWidth=8):
+    quant = quantClass.__new__(quantClass)
+    quant.__dict__.update(module.__dict__)
+
+    quant.bitWidth = bitWidth
+    quant.sfHolder = None
+    quant.prevLayer = None
+    quant.weightSF = 0
+    quant.siteName = None
+    quant.outputSF = 0
+
+    return quant
+
 class SFHolder(object):
     def __init__(self):
         self.sf = {'': 0}
@@ -0,0 +1,178 @@
+import torch
+import src.muppet.int_storage as int_storage
+import src.muppet.flat_buffers as flat_buffers
+import src.muppet.master_copy as master_copy
+
+class QuantOptimizer(torch.optim.Optimizer):
+    # FP32 master weights, gradient and weight quantization and precision bookkeeping shared by the
+    # quantized optimizers, subclasses implement update_param and may keep their state with save_moment
+    def __init__(self, params, _quantizer, defaults, masterCopy='Device', masterChunk=1<<24, momentBitWidth=-1):
+        self.quantizer = _quantizer
+        self.bitWidths = None
+        self.flatGroups = None
+        self.master = master_copy.create(masterCopy, masterChunk)
+
+        # optimizer state buffers are held as dynamic fixed point mantissas of this width, -1 keeps them in FP32
+        self.momentBitWidth = momentBitWidth
+        self.pendingMoments = []
+
+        super(QuantOptimizer, self).__init__(params, defaults)
+
+        for group in self.param_groups:
+            group['fpWeights'] = [self.master.create(p) for p in group['params']]
+
+    def state_dict(self):
+        # checkpoints hold the FP32 master copy whatever form it is kept in
+        state = super(QuantOptimizer, self).state_dict()
+        for group, packed in zip(self.param_groups, state['param_groups']):
+            packed['fpWeights'] = self.master.weights(group)
+        return state
+
+    def setup_master(self):
+        # bring master copies loaded from a checkpoint into the form they are kept in
+        for group in self.param_groups:
+            self.master.setup(group)
+
+    def release_master(self, weights=None):
+        # the given parameters (all if None) train on their FP32 master copy from now on,
+        # which is then no longer kept separately
+        for group in self.param_groups:
+            masters = self.master.weights(group)
+            for i, p in enumerate(group['params']):
+                if weights is None or p in weights:
+                    fp = masters[i].data.to(p.device)
+                    int_storage.release(p, fp)
+                    group['fpWeights'][i].data = fp
+
+    def flatten(self):
+        # move parameters, gradients and master copies into contiguous buffers, after any master copy has been loaded
+        if self.quantizer.intStorage:
+            raise ValueError('Flat_Buffers cannot be combined with Int_Storage')
+        if not hasattr(self, 'flat_update'):
+            raise ValueError('Flat_Buffers is not supported by {}'.format(type(self).__name__))
+        if type(self.master) is not master_copy.DeviceMaster:
+            raise ValueError('Flat_Buffers requires the master copy to be kept on the device')
+        self.flatGroups = [flat_buffers.flatten(group['params'], group['fpWeights']) for group in self.param_groups]
+
+    def zero_grad(self, set_to_none=False):
+        # flat gradient buffers are zeroed in place, newer torch versions would otherwise set the gradients
+        # to None and the next backward pass would allocate them outside of the buffers
+        if self.flatGroups is None:
+            return super(QuantOptimizer, self).zero_grad(set_to_none) if set_to_none else super(QuantOptimizer, self).zero_grad()
+
+        for group, flats in zip(self.param_groups, self.flatGroups):
+            for flat in flats:
+                flat.grad.zero_()
+                flat.attach_grads(group['params'])
+
+    def set_bit_widths(self, bitWidths):
+        # per parameter precisions, None quantizes every parameter to params.bitWidth
+        self.bitWidths = bitWidths
+
+    def bit_width(self, p, params):
+        if params.dataType == 'Float':
+            return -1
+        if self.bitWidths is None:
+            return params.bitWidth
+        return self.bitWidths.get(p, params.bitWidth)
+
+    def step(self, params, closure=None):
+        loss = None
+        if closure is not None:
+            loss = closure()
+
+        for groupIdx, group in enumerate(self.param_groups):
+            weights = group['params']
+
+            active = [i for i in range(len(weights)) if weights[i].grad is not None]
+            if active == []:
+                continue
+
+            # the flat updates read the gradient buffers, which have to hold the gradients of this step
+            if self.flatGroups is not None:
+                for flat in self.flatGroups[groupIdx]:
+                    flat.attach_grads(weights)
+
+            # bucket the group by precision, -1 marks parameters that train in FP32
+            buckets = {}
+            for i in active:
+                buckets.setdefault(self.bit_width(weights[i], params), []).append(i)
+
+            # a group with a single precision is updated with a few ops over its flat buffers
+            if self.flatGroups is not None and len(buckets) == 1 and len(active) == len(weights):
+                bitWidth = list(buckets)[0]
+                for flatIdx, flat in enumerate(self.flatGroups[groupIdx]):
+                    self.flat_update(flat, group, bitWidth, "{}.{}-{}".format(groupIdx, flatIdx, bitWidth))
+                continue
+
+            intStorage = self.quantizer.intStorage
+            for bitWidth, idx in buckets.items():
+                # parameters that train in FP32 are updated in place
+                if bitWidth == -1:
+                    for i in idx:
+                        self.update_param(group, weights[i], weights[i].data)
+                    self.store_moments()
+                    continue
+
+                # master copies that are not kept on the device are rebuilt a chunk of parameters at a time
+                chunks = self.master.chunks(idx, weights)
+                self.master.prefetch(group, chunks[0])
+                for chunkIdx, chunk in enumerate(chunks):
+                    loc = "{}-{}".format(groupIdx, bitWidth) + (".{}".format(chunkIdx) if len(chunks) > 1 else '')
+
+                    # quantize the gradients of the chunk at once
+                    grads, _ = self.quantizer.quantize_many([weights[i].grad.data for i in chunk], bitWidth, "optimizer-grad-" + loc)
+                    for i, grad in zip(chunk, grads):
+                        # flat gradient buffers have to keep receiving the gradients of the backward pass
+                        if self.flatGroups is not None:
+                            weights[i].grad.copy_(grad)
+                        else:
+                            weights[i].grad.data = grad
+
+                    fps = self.master.load(group, chunk)
+                    if chunkIdx+1 < len(chunks):
+                        self.master.prefetch(group, chunks[chunkIdx+1])
+
+                    for i, fp in zip(chunk, fps):
+                        self.update_param(group, weights[i], fp)
+                    self.store_moments()
+
+                    # quantize the updated FP32 weights for the upcoming forward pass
+                    quantWeights, _ = self.quantizer.quantize_many(fps, bitWidth, "optimizer-data-" + loc, asInt=intStorage)
+                    for i, weight in zip(chunk, quantWeights):
+                        if intStorage:
+                            int_storage.compress(weights[i], weight)
+                        elif self.flatGroups is not None:
+                            weights[i].data.copy_(weight)
+                        else:
+                            weights[i].data = weight
+                    self.master.store(group, chunk, fps, quantWeights)
+            
+        return loss
+
+    def update_param(self, group, p, fp):
+        # update the FP32 master weight fp of parameter p, whose gradient has been quantized
+        raise NotImplementedError
+
+    def moment(self, p, key):
+        # FP32 value of a state buffer, zero initialised
+        state = self.state[p]
+        if key not in state:
+            return torch.zeros_like(p.grad.data)
+        buf = state[key]
+        return buf.dequantize() if isinstance(buf, int_storage.QuantizedTensor) else buf
+
+    def save_moment(self, p, key, buf):
+        # state buffers of a chunk are quantized together once the chunk has been updated
+        if self.momentBitWidth == -1:
+            self.state[p][key] = buf
+        else:
+            self.pendingMoments.append((p, key, buf))
+
+    def store_moments(self):
+        if self.pendingMoments == []:
+            return
+        quantized, _ = self.quantizer.quantize_many([buf for _, _, buf in self.pendingMoments], self.momentBitWidth, asInt=True)
+        for (p, key, _), buf in zip(self.pendingMoments, quantized):
+            self.state[p][key] = buf
+        self.pendingMoments = []
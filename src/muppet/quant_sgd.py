@@ -1,13 +1,44 @@
 import torch
 import src.muppet.quantize as quantize
+import src.muppet.int_storage as int_storage
+import src.muppet.quant_optimizer as quant_optimizer
 import sys
 import copy
 from torch.optim.optimizer import required
 
+# weight decay, momentum and master weight update of a flat group in one kernel, written with the same ops
+# in the same order as the unfused step so that the results are bit identical
+@torch.jit.script
+def _sgd_update(grad, weight, fp, buf, weightDecay: float, momentum: float, dampening: float, lr: float, nesterov: bool, hasBuf: bool):
+    if weightDecay != 0:
+        grad = torch.add(grad, weight, alpha=weightDecay)
+    d_p = grad
+    if momentum != 0:
+        if hasBuf:
+            buf = torch.add(buf * momentum, grad, alpha=1 - dampening)
+        else:
+            buf = grad
+        if nesterov:
+            d_p = torch.add(grad, buf, alpha=momentum)
+        else:
+            d_p = buf
+    return grad, buf, torch.add(fp, d_p, alpha=-lr)
 
-class QuantSGD(torch.optim.Optimizer):
-    def __init__(self, params, _quantizer, lr=required, momentum=0, dampening=0, weight_decay=0, nesterov=False):
-        self.quantizer = _quantizer
+# the same with the gradient quantization in front, scale holds the per element scale of the group
+@torch.jit.script
+def _quant_sgd_update(grad, scale, weight, fp, buf, weightDecay: float, momentum: float, dampening: float, lr: float, nesterov: bool, hasBuf: bool):
+    grad = torch.round(grad * scale) / scale
+    return _sgd_update(grad, weight, fp, buf, weightDecay, momentum, dampening, lr, nesterov, hasBuf)
+
+@torch.jit.script
+def _quant_sgd_stoch_update(grad, noise, scale, weight, fp, buf, weightDecay: float, momentum: float, dampening: float, lr: float, nesterov: bool, hasBuf: bool):
+    grad = torch.round(grad * scale + noise) / scale
+    return _sgd_update(grad, weight, fp, buf, weightDecay, momentum, dampening, lr, nesterov, hasBuf)
+
+
+class QuantSGD(quant_optimizer.QuantOptimizer):
+    def __init__(self, params, _quantizer, lr=required, momentum=0, dampening=0, weight_decay=0, nesterov=False, masterCopy='Device', masterChunk=1<<24, fusedStep=False):
+        self.fusedStep = fusedStep
 
         if lr is not required and lr < 0.0:
             raise ValueError("Invalid learning rate: {}".format(lr))
@@ -16,65 +47,112 @@ class QuantSGD(torch.optim.Optimizer):
         if weight_decay < 0.0:
             raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
 
-        defaults = dict(lr=lr, momentum=momentum, dampening=dampening, weight_decay=weight_decay, nesterov=nesterov, fpWeights=[])
+        defaults = dict(lr=lr, momentum=momentum, dampening=dampening, weight_decay=weight_decay, nesterov=nesterov)
         if nesterov and (momentum <= 0 or dampening != 0):
             raise ValueError("Nesterov momentum requires a momentum and zero dampening")
-        super(QuantSGD, self).__init__(params, defaults)
-
-        for group in self.param_groups:
-            for i in range(len(group['params'])):
-                group['fpWeights'].append(copy.deepcopy(group['params'][i]))
+        super(QuantSGD, self).__init__(params, _quantizer, defaults, masterCopy, masterChunk)
 
     def __setstate__(self, state):
         super(QuantSGD, self).__setstate__(state)
         for group in self.param_groups:
             group.setdefault('nesterov', False)
 
-    def step(self, params, closure=None):
-        loss = None
-        if closure is not None:
-            loss = closure()
+    def update_param(self, group, p, fp):
+        weight_decay = group['weight_decay']
+        momentum = group['momentum']
+        dampening = group['dampening']
+        nesterov = group['nesterov']
 
-        for group in self.param_groups:
-            weight_decay = group['weight_decay']
-            momentum = group['momentum']
-            dampening = group['dampening']
-            nesterov = group['nesterov']
-            fpWeights = group['fpWeights']
-            weights = group['params']
-
-            for i in range(len(weights)):
-                p = weights[i]
-                fp = fpWeights[i]
-
-                if p.grad is None:
-                    continue
-
-                # quantize the gradients
-                if params.dataType != 'Float':
-                    p.grad.data, _ = self.quantizer.quantize_inputs(p.grad.data, params.bitWidth, "optimizer-grad-{}".format(p.grad.data.shape))
-                
-                d_p = p.grad.data
-                
-                if weight_decay != 0:
-                    d_p.add_(weight_decay, p.data)
-                if momentum != 0:
-                    param_state = self.state[p]
-                    if 'momentum_buffer' not in param_state:
-                        buf = param_state['momentum_buffer'] = torch.clone(d_p).detach()
-                    else:
-                        buf = param_state['momentum_buffer']
-                        buf.mul_(momentum).add_(1 - dampening, d_p)
-                    if nesterov:
-                        d_p = d_p.add(momentum, buf)
-                    else:
-                        d_p = buf
-
-                # if still in dynamic fixed point, quantize updated FP32 weights to target precision for upcoming forward pass
-                if params.dataType == 'Float':
-                    p.data.add_(-group['lr'], d_p)
-                else:
-                    fp.data.add_(-group['lr'], d_p)
-                    p.data, _ = self.quantizer.quantize_inputs(fp.data, params.bitWidth, "optimizer-data-{}".format(p.data.shape))
-            
-        return loss
+        d_p = p.grad.data
+        
+        if weight_decay != 0:
+            d_p.add_(int_storage.value_of(p), alpha=weight_decay)
+        if momentum != 0:
+            param_state = self.state[p]
+            if 'momentum_buffer' not in param_state:
+                buf = param_state['momentum_buffer'] = torch.clone(d_p).detach()
+            else:
+                buf = param_state['momentum_buffer']
+                buf.mul_(momentum).add_(d_p, alpha=1 - dampening)
+            if nesterov:
+                d_p = d_p.add(buf, alpha=momentum)
+            else:
+                d_p = buf
+
+        fp.add_(d_p, alpha=-group['lr'])
+
+    def flat_update(self, flat, group, bitWidth, loc):
+        # cached exponents and telemetry need the quantized gradient on its own
+        if self.fusedStep and self.quantizer.cache is None and self.quantizer.telemetry is None:
+            self.fused_step(flat, group, bitWidth, loc)
+        else:
+            self.flat_step(flat, group, bitWidth, loc)
+
+    def flat_step(self, flat, group, bitWidth, loc):
+        weight_decay = group['weight_decay']
+        momentum = group['momentum']
+        dampening = group['dampening']
+        nesterov = group['nesterov']
+
+        if bitWidth != -1:
+            grad, _ = self.quantizer.quantize_flat(flat.grad, flat.lengths, bitWidth, "optimizer-grad-" + loc)
+            flat.grad.copy_(grad)
+
+        d_p = flat.grad
+        if weight_decay != 0:
+            # parameters that train in FP32 share the master copy
+            d_p.add_(flat.fp if bitWidth == -1 else flat.param, alpha=weight_decay)
+        if momentum != 0:
+            buf = flat.momentum_buffer(group['params'], self.state)
+            if buf is None:
+                flat.momentum = torch.clone(d_p).detach()
+                flat.share_momentum(group['params'], self.state)
+                buf = flat.momentum
+            else:
+                buf.mul_(momentum).add_(d_p, alpha=1 - dampening)
+            if nesterov:
+                d_p = d_p.add(buf, alpha=momentum)
+            else:
+                d_p = buf
+
+        flat.fp.add_(d_p, alpha=-group['lr'])
+
+        if bitWidth != -1:
+            weight, _ = self.quantizer.quantize_flat(flat.fp, flat.lengths, bitWidth, "optimizer-data-" + loc)
+            flat.param.copy_(weight)
+
+    def fused_step(self, flat, group, bitWidth, loc):
+        # one reduction for the gradient exponents, one kernel for quantization, decay, momentum and update,
+        # then the requantization of the master weights
+        momentum = group['momentum']
+        buf = flat.momentum_buffer(group['params'], self.state) if momentum != 0 else None
+        hasBuf = buf is not None
+
+        # parameters that train in FP32 share the master copy
+        weight = flat.fp if bitWidth == -1 else flat.param
+        args = (weight, flat.fp, buf if hasBuf else flat.grad, group['weight_decay'], momentum, group['dampening'], group['lr'], group['nesterov'], hasBuf)
+
+        if bitWidth == -1:
+            grad, buf, fp = _sgd_update(flat.grad, *args)
+        else:
+            scale, _ = self.quantizer.segment_scale(flat.grad, flat.lengths, bitWidth)
+            if self.quantizer.roundMeth == 'Simple':
+                grad, buf, fp = _quant_sgd_update(flat.grad, scale, *args)
+            elif self.quantizer.roundMeth == 'Stochastic':
+                noise = self.quantizer.noise.get(flat.grad.size(), flat.grad.device, flat.grad.dtype)
+                grad, buf, fp = _quant_sgd_stoch_update(flat.grad, noise, scale, *args)
+            else:
+                raise ValueError("Rounding method should be one of 'Simple' or 'Stochastic'")
+
+        flat.grad.copy_(grad)
+        flat.fp.copy_(fp)
+        if momentum != 0:
+            if hasBuf:
+                flat.momentum.copy_(buf)
+            else:
+                flat.momentum = torch.clone(buf).detach()
+                flat.share_momentum(group['params'], self.state)
+
+        if bitWidth != -1:
+            weight, _ = self.quantizer.quantize_flat(flat.fp, flat.lengths, bitWidth, "optimizer-data-" + loc)
+            flat.param.copy_(weight)
@@ -1,30 +1,258 @@
 import sys
 import torch
+import torch.utils.data
 import copy
 import math
 import random as rand
 import time
-import csv
+
+from src.muppet.noise_pool import NoisePool
+from src.muppet.sf_cache import ScaleCache
+from src.muppet.int_storage import QuantizedTensor, mantissa_dtype
+from src.muppet.telemetry import QuantTelemetry
+
+# elementwise tail of the fused backend, scripted so that the multiply, round
+# and rescale are emitted as a single kernel by the TorchScript fuser
+@torch.jit.script
+def _fused_round(x, scale: float, invScale: float):
+    return torch.round(x * scale) * invScale
+
+@torch.jit.script
+def _fused_stoch_round(x, noise, scale: float, invScale: float):
+    return torch.round(x * scale + noise) * invScale
+
+# variants taking the scale as a 0-dim device tensor for the sync free path
+@torch.jit.script
+def _device_round(x, scale, invScale):
+    return torch.round(x * scale) * invScale
+
+@torch.jit.script
+def _device_stoch_round(x, noise, scale, invScale):
+    return torch.round(x * scale + noise) * invScale
+
+# per element scale variants used when a flattened group is quantized at once
+@torch.jit.script
+def _segment_round(x, scale):
+    return torch.round(x * scale) / scale
+
+@torch.jit.script
+def _segment_stoch_round(x, noise, scale):
+    return torch.round(x * scale + noise) / scale
+
+# batch norm affine transform, clipped activation and rounding of the fused
+# QuantConvBNReLU block in one kernel, a and b hold the per channel affine terms
+@torch.jit.script
+def _bn_act_round(x, a, b, lower: float, upper: float, scale, invScale):
+    return torch.round(torch.clamp(x * a + b, lower, upper) * scale) * invScale
+
+@torch.jit.script
+def _bn_act_stoch_round(x, noise, a, b, lower: float, upper: float, scale, invScale):
+    return torch.round(torch.clamp(x * a + b, lower, upper) * scale + noise) * invScale
+
+# exponents computed on the device are clamped so that 2^sf stays finite in FP32
+SF_LIMIT = 126
+
+def _min_max(x):
+    # single reduction for both extremes where the installed torch supports it
+    if hasattr(torch, 'aminmax'):
+        return torch.aminmax(x)
+    elif hasattr(torch, '_aminmax'):
+        return torch._aminmax(x)
+    else:
+        return torch.min(x), torch.max(x)
+
+def _segment_min_max(flat, segIds, lengths):
+    # per segment extremes of a flattened group
+    if hasattr(flat, 'scatter_reduce_'):
+        minT = flat.new_zeros(len(lengths)).scatter_reduce_(0, segIds, flat, 'amin', include_self=False)
+        maxT = flat.new_zeros(len(lengths)).scatter_reduce_(0, segIds, flat, 'amax', include_self=False)
+        return minT, maxT
+    else:
+        extremes = [_min_max(segment) for segment in flat.split(lengths)]
+        return torch.stack([e[0] for e in extremes]), torch.stack([e[1] for e in extremes])
+
+def _batch_min_max(x):
+    # per sample extremes over the non-batch dimensions
+    flat = x.reshape(x.size(0), -1)
+    if hasattr(torch, 'aminmax'):
+        return torch.aminmax(flat, dim=1)
+    elif hasattr(torch, '_aminmax'):
+        return torch._aminmax(flat, 1)
+    else:
+        return flat.min(dim=1)[0], flat.max(dim=1)[0]
 
 class Quantizer(object):
-    def __init__(self, roundMeth):
-        self.roundMeth = roundMeth
+    def __init__(self, roundMeth, syncFree=False, seed=None, sfRefreshInterval=1, sfSatThreshold=0.01, intStorage=False, telemetryPath='', telemetrySampleRate=1.0):
+        # 'FusedSimple' and 'FusedStochastic' select the single pass backend
+        self.fused = roundMeth.startswith('Fused')
+        self.roundMeth = roundMeth[len('Fused'):] if self.fused else roundMeth
+
+        # keep scale factors on the device and defer the non-finite check to check_errors
+        self.syncFree = syncFree
+        self.errorCounts = {}
+
+        # reusable, seeded noise for stochastic rounding on any device
+        self.noise = NoisePool(seed)
+
+        # reuse exponents per quantization site for several steps
+        self.cache = ScaleCache(sfRefreshInterval, sfSatThreshold) if sfRefreshInterval > 1 else None
 
-    def log(self, line):
-        with open('quant.csv', 'a') as csvfile:
-            writer = csv.writer(csvfile, delimiter=',')
-            writer.writerow(line)
+        # element to tensor maps for the flattened groups of quantize_many
+        self.segIds = {}
+
+        # hold quantized weights and saved activations as integer mantissas
+        self.intStorage = intStorage
+
+        # sampled per-site statistics, written in batches by a background thread
+        self.telemetry = QuantTelemetry(telemetryPath, telemetrySampleRate) if telemetryPath != '' else None
+        self.stepCount = 0
 
     def quantize_inputs(self, inputs, bitWidth, loc=None):
-        if isinstance(inputs, torch.Tensor): 
-            tmp = inputs.clone()
-        else: 
+        if not isinstance(inputs, torch.Tensor): 
             raise TypeError
 
-        scaleMat, scaleFac = self.scale(tmp, bitWidth)
-        scaleMat.mul_(pow(2, -scaleFac))
+        if self.cache is not None and loc is not None:
+            sf = self.cache.lookup(loc, bitWidth)
+            if sf is not None:
+                scaleMat, scaleFac = self.cached_quantize(inputs, bitWidth, sf, loc)
+                self.log(loc, inputs, scaleMat, scaleFac, bitWidth)
+                return scaleMat, scaleFac
+
+        if self.syncFree:
+            scaleMat, scaleFac = self.device_quantize(inputs, bitWidth)
+        elif self.fused:
+            scaleMat, scaleFac = self.fused_quantize(inputs, bitWidth)
+        else:
+            tmp = inputs.clone()
+            scaleMat, scaleFac = self.scale(tmp, bitWidth)
+            scaleMat.mul_(pow(2, -scaleFac))
+
+        if self.cache is not None and loc is not None:
+            self.cache.store(loc, bitWidth, scaleFac)
+
+        self.log(loc, inputs, scaleMat, scaleFac, bitWidth)
         
         return scaleMat, scaleFac
+
+    def quantize_batch(self, inputs, bitWidth, loc=None):
+        # per sample exponents from one reduction over the non-batch dimensions and one elementwise
+        # pass over the whole batch, equivalent to quantize_inputs on every sample
+        minT, maxT = _batch_min_max(inputs)
+        sf = self.range_exponent(minT, maxT, bitWidth)
+        scale = torch.pow(2.0, sf).view((-1,) + (1,) * (inputs.dim() - 1))
+
+        if self.roundMeth == 'Simple':
+            scaled = _segment_round(inputs, scale)
+        elif self.roundMeth == 'Stochastic':
+            noise = self.noise.get(inputs.size(), inputs.device, inputs.dtype)
+            scaled = _segment_stoch_round(inputs, noise, scale)
+        else:
+            raise ValueError("Rounding method should be one of 'Simple' or 'Stochastic'")
+
+        self.log(loc, inputs, scaled, sf.view_as(scale), bitWidth)
+        return scaled, sf
+
+    def log(self, loc, inputs, quantized, sf, bitWidth):
+        if self.telemetry is not None and loc is not None and self.telemetry.sample(loc):
+            self.telemetry.record(loc, inputs, quantized, sf, bitWidth, self.stepCount)
+
+    def quantize_many(self, tensors, bitWidth, loc=None, asInt=False):
+        # quantize a list of tensors with per tensor exponents, using one flattened buffer
+        # and a segmented reduction instead of a reduction and elementwise pass per tensor
+        # if asInt is set, QuantizedTensors holding the integer mantissas are returned
+        lengths = [t.numel() for t in tensors]
+        flat = torch.cat([t.reshape(-1) for t in tensors])
+        scaled, sf = self.quantize_flat(flat, lengths, bitWidth, loc)
+
+        if asInt:
+            segIds = self.segment_ids(lengths, flat.device)
+            val = 1 << (bitWidth-1)
+            values = (scaled * torch.pow(2.0, sf)[segIds]).round_().clamp_(-val, val-1).to(mantissa_dtype(bitWidth))
+            quantized = [QuantizedTensor(segment.view_as(t), sf[i], t.dtype) for i, (segment, t) in enumerate(zip(values.split(lengths), tensors))]
+            return quantized, sf
+
+        # hand back views into the quantized buffer shaped like the inputs
+        quantized = [segment.view_as(t) for segment, t in zip(scaled.split(lengths), tensors)]
+
+        return quantized, sf
+
+    def quantize_flat(self, flat, lengths, bitWidth, loc=None):
+        # quantize a flat buffer made of consecutive segments of the given lengths, one exponent per segment
+        segIds = self.segment_ids(lengths, flat.device)
+
+        sf = None
+        if self.cache is not None and loc is not None:
+            sf = self.cache.lookup(loc, bitWidth)
+
+        if sf is not None:
+            scaled, _ = self.cached_quantize(flat, bitWidth, sf[segIds], loc)
+        else:
+            minT, maxT = _segment_min_max(flat, segIds, lengths)
+            sf = self.range_exponent(minT, maxT, bitWidth)
+            scale = torch.pow(2.0, sf)[segIds]
+
+            if self.roundMeth == 'Simple':
+                scaled = _segment_round(flat, scale)
+            elif self.roundMeth == 'Stochastic':
+                noise = self.noise.get(flat.size(), flat.device, flat.dtype)
+                scaled = _segment_stoch_round(flat, noise, scale)
+            else:
+                raise ValueError("Rounding method should be one of 'Simple' or 'Stochastic'")
+
+            if self.cache is not None and loc is not None:
+                self.cache.store(loc, bitWidth, sf)
+
+        if self.telemetry is not None and loc is not None and self.telemetry.sample(loc):
+            self.telemetry.record(loc, flat, scaled, sf[segIds], bitWidth, self.stepCount)
+
+        return scaled, sf
+
+    def segment_scale(self, flat, lengths, bitWidth):
+        # per element scale of a flat buffer, for kernels that do the rounding themselves
+        segIds = self.segment_ids(lengths, flat.device)
+        minT, maxT = _segment_min_max(flat, segIds, lengths)
+        sf = self.range_exponent(minT, maxT, bitWidth)
+        return torch.pow(2.0, sf)[segIds], sf
+
+    def segment_ids(self, lengths, device):
+        key = (tuple(lengths), device)
+        if key not in self.segIds:
+            repeats = torch.tensor(lengths, device=device)
+            self.segIds[key] = torch.repeat_interleave(torch.arange(len(lengths), device=device), repeats)
+        return self.segIds[key]
+
+    def cached_quantize(self, inputs, bitWidth, sf, loc):
+        # no reduction for the exponent, values outside the range are clamped and counted instead
+        val = 1 << (bitWidth-1)
+        maxVal = (val - 1) + 0.5
+        minVal = (-val) - 0.5
+
+        if isinstance(sf, torch.Tensor):
+            scale, invScale = torch.pow(2.0, sf), torch.pow(2.0, -sf)
+        else:
+            scale, invScale = pow(2.0, sf), pow(2.0, -sf)
+
+        scaled = inputs * scale
+        if self.roundMeth == 'Stochastic':
+            scaled.add_(self.noise.get(scaled.size(), scaled.device, scaled.dtype))
+        
+        saturated = ((scaled > maxVal) | (scaled < minVal)).sum()
+        self.cache.record(loc, saturated, scaled.numel())
+
+        scaled = scaled.round_().clamp_(-val, val-1).mul_(invScale)
+
+        return scaled, sf
+
+    def step(self):
+        # end of training step bookkeeping
+        self.stepCount += 1
+        self.check_errors()
+        if self.cache is not None:
+            self.cache.step()
+
+    def close(self):
+        if self.telemetry is not None:
+            self.telemetry.close()
          
     def scale(self, scaled, bitWidth):
 
@@ -48,6 +276,86 @@ class Quantizer(object):
 
         return scaled, sf
 
+    def fused_quantize(self, inputs, bitWidth):
+        # one reduction for min and max, a single transfer of both to the host
+        # and one elementwise pass writing the rounded, rescaled output
+        minT, maxT = _min_max(inputs)
+        minV, maxV = torch.stack((minT, maxT)).tolist()
+
+        if maxV == 0 and minV == 0:
+            return torch.zeros_like(inputs), 0
+
+        if not (math.isfinite(maxV) and math.isfinite(minV)):
+            raise ValueError
+
+        val = 1 << (bitWidth-1)
+        maxVal = (val - 1) + 0.5
+        minVal = (-val) - 0.5
+
+        rangeBest = min(abs(maxVal/maxV) if maxV != 0 else math.inf, abs(minVal/minV) if minV != 0 else math.inf)
+        sf = math.floor(math.log2(rangeBest))
+
+        if self.roundMeth == 'Simple':
+            scaled = _fused_round(inputs, pow(2.0, sf), pow(2.0, -sf))
+        elif self.roundMeth == 'Stochastic':
+            noise = self.noise.get(inputs.size(), inputs.device, inputs.dtype)
+            scaled = _fused_stoch_round(inputs, noise, pow(2.0, sf), pow(2.0, -sf))
+        else:
+            raise ValueError("Rounding method should be one of 'Simple' or 'Stochastic'")
+
+        return scaled, sf
+
+    def device_quantize(self, inputs, bitWidth):
+        # same computation as fused_quantize, but the exponent never leaves the device
+        minT, maxT = _min_max(inputs)
+        sf = self.range_exponent(minT, maxT, bitWidth)
+        scale = torch.pow(2.0, sf)
+        invScale = torch.pow(2.0, -sf)
+
+        if self.roundMeth == 'Simple':
+            scaled = _device_round(inputs, scale, invScale)
+        elif self.roundMeth == 'Stochastic':
+            noise = self.noise.get(inputs.size(), inputs.device, inputs.dtype)
+            scaled = _device_stoch_round(inputs, noise, scale, invScale)
+        else:
+            raise ValueError("Rounding method should be one of 'Simple' or 'Stochastic'")
+
+        return scaled, sf
+
+    def range_exponent(self, minT, maxT, bitWidth):
+        # exponent(s) on the device for tensors with the given extremes, minT and maxT
+        # are either 0-dim or hold one entry per tensor
+        if self.syncFree:
+            self.flag_non_finite(minT, maxT)
+        elif not bool(torch.isfinite(torch.cat((minT.reshape(-1), maxT.reshape(-1)))).all()):
+            raise ValueError
+
+        val = 1 << (bitWidth-1)
+        maxVal = (val - 1) + 0.5
+        minVal = (-val) - 0.5
+
+        # an all zero tensor gives an infinite range, which the clamp turns into a harmless 2^SF_LIMIT
+        rangeBest = torch.min((maxVal / maxT).abs(), (minVal / minT).abs())
+        return torch.floor(torch.log2(rangeBest)).clamp_(-SF_LIMIT, SF_LIMIT)
+
+    def flag_non_finite(self, minT, maxT):
+        device = minT.device
+        if device not in self.errorCounts:
+            self.errorCounts[device] = torch.zeros((), dtype=torch.int64, device=device)
+        self.errorCounts[device].add_((~torch.isfinite(torch.cat((minT.reshape(-1), maxT.reshape(-1))))).any())
+
+    def check_errors(self):
+        # called once per step, the only point at which the sync free path waits on the device
+        if not self.errorCounts:
+            return
+
+        errors = sum(count.item() for count in self.errorCounts.values())
+        for count in self.errorCounts.values():
+            count.zero_()
+
+        if errors != 0:
+            raise ValueError("{} quantized tensors contained non-finite values".format(errors))
+
     def findSfAndScale(self, scaled, maxVal, minVal):
         rangeBest = min(abs(maxVal/torch.max(scaled)), abs(minVal/torch.min(scaled)))
         # floor returns int value closest to zero
@@ -62,12 +370,64 @@ class Quantizer(object):
         scaled, sf = self.findSfAndScale(scaled, maxVal, minVal)
 
         # add values in rand -0.5 -> 0.5 to potentially tip rounding in a certain direction
-        mod = torch.FloatTensor(scaled.size()).cuda(scaled.device)
-        mod.uniform_(-0.5, 0.5)
-        scaled.add_(mod)
+        scaled.add_(self.noise.get(scaled.size(), scaled.device, scaled.dtype))
 
         return scaled.round(), sf
 
     def simpleRound(self, scaled, maxVal, minVal):
         scaled, sf = self.findSfAndScale(scaled, maxVal, minVal)
         return scaled.round(), sf
+
+# loader worker id set by InputWorkerInit, for torch versions without get_worker_info
+_loaderWorkerId = None
+
+class InputWorkerInit(object):
+    # worker_init_fn recording the id of the loader worker for QuantizeCollate, chained with any previous one
+    def __init__(self, previous=None):
+        self.previous = previous
+
+    def __call__(self, workerId):
+        global _loaderWorkerId
+        _loaderWorkerId = workerId
+        if self.previous is not None:
+            self.previous(workerId)
+
+class QuantizeCollate(object):
+    # collate function quantizing each training batch in the DataLoader worker that builds it, so that
+    # input quantization overlaps with compute, the workers started every epoch pick up the current bitWidth and epoch
+    def __init__(self, collate, roundMeth, seed=None, numWorkers=0):
+        self.collate = collate
+        self.numWorkers = numWorkers
+        self.roundMeth = roundMeth
+        self.seed = seed
+        self.bitWidth = -1
+        self.epoch = 0
+        self.quantizer = None
+        self.key = None
+
+    def worker_seed(self):
+        # stochastic rounding noise of every worker and epoch derived from the run seed, batches are handed
+        # to the workers in a fixed order so a seeded run is reproducible
+        # get_worker_info is part of torch 1.2 and later, older versions rely on InputWorkerInit
+        info = torch.utils.data.get_worker_info() if hasattr(torch.utils.data, 'get_worker_info') else None
+        if info is not None:
+            workerId, numWorkers = info.id, info.num_workers
+        else:
+            workerId = _loaderWorkerId if _loaderWorkerId is not None else 0
+            numWorkers = max(self.numWorkers, 1)
+        key = (self.epoch, workerId)
+        if self.seed is None:
+            return key, None
+        return key, (self.seed * 1000003 + self.epoch * numWorkers + workerId) % (1 << 63)
+
+    def __call__(self, batch):
+        inputs, targets = self.collate(batch)
+        if self.bitWidth == -1:
+            return inputs, targets
+
+        key, seed = self.worker_seed()
+        if self.quantizer is None or key != self.key:
+            self.quantizer = Quantizer(self.roundMeth, seed=seed)
+            self.key = key
+        inputs, _ = self.quantizer.quantize_batch(inputs, self.bitWidth)
+        return inputs, targets
@@ -0,0 +1,102 @@
+import torch
+
+# quantization sites are identified by '<role>-<layer>' strings
+ROLES = ('forward', 'backward', 'optimizer-grad', 'optimizer-data')
+
+def site_role(loc):
+    for role in ROLES:
+        if loc.startswith(role):
+            return role
+    return None
+
+class ScaleCache(object):
+    """Per-site cache of dynamic fixed-point exponents.
+
+    An exponent computed by a full min/max reduction is reused for up to
+    refreshInterval steps. While cached, the quantizer counts the elements that
+    saturate the representable range, and a site whose saturation fraction over
+    a step exceeds satThreshold is recomputed on its next call.
+    """
+    def __init__(self, refreshInterval, satThreshold):
+        self.refreshInterval = refreshInterval
+        self.satThreshold = satThreshold
+        self.stepCount = 0
+        self.entries = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = {role: 0 for role in ROLES}
+        self.misses = {role: 0 for role in ROLES}
+        self.saturated = {role: 0 for role in ROLES}
+        self.elements = {role: 0 for role in ROLES}
+
+    def lookup(self, loc, bitWidth):
+        role = site_role(loc)
+        if role is None:
+            return None
+
+        entry = self.entries.get(loc)
+        if entry is None or entry['bitWidth'] != bitWidth or entry['stale'] or (self.stepCount - entry['step']) >= self.refreshInterval:
+            self.misses[role] += 1
+            return None
+
+        self.hits[role] += 1
+        return entry['sf']
+
+    def store(self, loc, bitWidth, sf):
+        if site_role(loc) is None:
+            return
+        self.entries[loc] = {'sf': sf, 'bitWidth': bitWidth, 'step': self.stepCount, 'stale': False, 'saturated': None, 'elements': 0}
+
+    def record(self, loc, saturated, numel):
+        # saturated is a device tensor, summed on the device and only read back once per step in step()
+        entry = self.entries[loc]
+        entry['saturated'] = saturated if entry['saturated'] is None else entry['saturated'] + saturated
+        entry['elements'] += numel
+
+    def discard(self):
+        # saturation recorded outside of training steps, e.g. by inference, is dropped along with the lookups
+        for entry in self.entries.values():
+            entry['saturated'] = None
+            entry['elements'] = 0
+        self.reset_stats()
+
+    def step(self):
+        self.stepCount += 1
+
+        # gather the saturation counts of every site with one transfer per device
+        counts = {}
+        for loc, entry in self.entries.items():
+            if entry['saturated'] is not None:
+                counts.setdefault(entry['saturated'].device, []).append((loc, entry['saturated']))
+
+        satPerSite = {}
+        for device, pending in counts.items():
+            values = torch.stack([count for _, count in pending]).tolist()
+            for (loc, _), value in zip(pending, values):
+                satPerSite[loc] = satPerSite.get(loc, 0) + value
+
+        for loc, entry in self.entries.items():
+            if entry['elements'] == 0:
+                continue
+
+            role = site_role(loc)
+            saturated = satPerSite.get(loc, 0)
+            self.saturated[role] += saturated
+            self.elements[role] += entry['elements']
+
+            if (saturated / entry['elements']) > self.satThreshold:
+                entry['stale'] = True
+            entry['saturated'] = None
+            entry['elements'] = 0
+
+    def stats(self):
+        stats = {}
+        for role in ROLES:
+            lookups = self.hits[role] + self.misses[role]
+            if lookups == 0:
+                continue
+            hitRate = self.hits[role] / lookups
+            satRate = (self.saturated[role] / self.elements[role]) if self.elements[role] != 0 else 0
+            stats[role] = (hitRate, satRate)
+        return stats
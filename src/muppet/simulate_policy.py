@@ -0,0 +1,91 @@
+import os
+import sys
+import types
+import argparse
+import itertools
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+import src.muppet.policy as policySrc
+
+import numpy as np
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser(description='Replay recorded gradient statistics through the MuPPET policy')
+    parser.add_argument('--record', required=True, type=str, help='.npz file written with GD_Record_Path')
+    parser.add_argument('--resolution', default=[3], nargs='+', type=int, help='policy resolutions to sweep')
+    parser.add_argument('--patience', default=[2], nargs='+', type=int, help='policy patiences to sweep')
+    parser.add_argument('--threshold-scale', default=[1.5], nargs='+', type=float, help='threshold scales to sweep')
+    parser.add_argument('--threshold-decay', default=[0.1], nargs='+', type=float, help='threshold decays to sweep')
+    parser.add_argument('--prec-schedule', default=None, nargs='+', type=int, help='precision schedule, defaults to the recorded one')
+    args = parser.parse_args()
+    return args
+
+class ReplayAccumulator(object):
+    # stands in for GDAccumulator, rebuilding the sums over the epochs folded since the last reset from the record
+    def __init__(self, record):
+        self.norms = record['norms']
+        self.dots = record['dots']
+        self.reset()
+
+    def reset(self):
+        self.rows = []
+
+    def add(self, row):
+        self.rows.append(row)
+
+    @property
+    def folds(self):
+        return len(self.rows)
+
+    def diversity(self):
+        window = self.dots.shape[1]
+        if len(self.rows) > window:
+            raise ValueError('policy resolution {} exceeds the recorded window of {} epochs'.format(len(self.rows), window))
+
+        sumOfNorms = self.norms[self.rows].sum(0)
+        gradNorms = np.zeros_like(sumOfNorms)
+        for j, row in enumerate(self.rows):
+            gradNorms += self.dots[row, 0]
+            for i in range(j):
+                gradNorms += 2 * self.dots[row, j-i]
+        return sumOfNorms / gradNorms
+
+def simulate(record, resolution, patience, thresholdScale, thresholdDecay, precSchedule):
+    # precision switch epochs the policy would have taken, assuming the recorded statistics do not depend on them
+    epochs = record['epoch']
+    params = types.SimpleNamespace(epochs=int(epochs.max())+1, policyResolution=resolution, policyPatience=patience, \
+                                   thresholdScale=thresholdScale, thresholdDecay=thresholdDecay, precEpochSchedule=[], \
+                                   precSchedule=precSchedule, bitWidth=precSchedule[0], dataType='DFixed', \
+                                   meanGD=1, maxGD=0, gdViolations=0, threshold=-1)
+    policy = policySrc.Policy(params)
+    policy.accumulator = ReplayAccumulator(record)
+    quiet = types.SimpleNamespace(write=lambda line: None)
+
+    switches = []
+    for row, epoch in enumerate(epochs):
+        policy.accumulator.add(row)
+        if policy.check_violation(int(epoch), quiet, None):
+            policy.advance_precision()
+            switches.append((int(epoch), params.bitWidth))
+            if params.dataType == 'Float':
+                break
+    return switches
+
+def recorded_switches(record):
+    bitWidths = record['bitWidth']
+    return [(int(record['epoch'][i-1]), int(bitWidths[i])) for i in range(1, len(bitWidths)) if bitWidths[i] != bitWidths[i-1]]
+
+def main():
+    args = parse_command_line_args()
+    with np.load(args.record) as f:
+        record = {k: f[k] for k in f.files}
+    precSchedule = args.prec_schedule if args.prec_schedule is not None else [int(x) for x in record['precSchedule']]
+
+    print('Recorded switches: {}'.format(' '.join('{}:{}'.format(e, b) for e, b in recorded_switches(record))))
+    print('Resolution,\tPatience,\tScale,\tDecay,\tSwitches (epoch:bitwidth)')
+    for resolution, patience, scale, decay in itertools.product(args.resolution, args.patience, args.threshold_scale, args.threshold_decay):
+        switches = simulate(record, resolution, patience, scale, decay, precSchedule)
+        print('{},\t\t{},\t\t{},\t{},\t{}'.format(resolution, patience, scale, decay, ' '.join('{}:{}'.format(e, b) for e, b in switches)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import json
+import queue
+import threading
+
+import numpy as np
+import torch
+
+class QuantTelemetry(object):
+    """Low overhead per-site quantization statistics.
+
+    Sampled calls write one row of statistics into a preallocated ring buffer on
+    the device of the quantized tensor, without reading anything back. When a
+    buffer fills up it is copied to the host in one transfer and handed to a
+    writer thread, which stores every batch of rows as a columnar .npz chunk in
+    the telemetry directory. Site ids are resolved through sites.json.
+    """
+    COLUMNS = ('step', 'site', 'bitWidth', 'exponent', 'saturation', 'underflow', 'roundError')
+
+    def __init__(self, path, sampleRate=1.0, capacity=4096):
+        self.path = path
+        self.every = max(1, int(round(1.0 / sampleRate)))
+        self.capacity = capacity
+
+        self.sites = {}
+        self.calls = {}
+        self.buffers = {}
+        self.chunk = 0
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self.write_chunks, daemon=True)
+        self.writer.start()
+
+    def sample(self, loc):
+        count = self.calls.get(loc, 0)
+        self.calls[loc] = count + 1
+        return (count % self.every) == 0
+
+    def record(self, loc, inputs, quantized, sf, bitWidth, step):
+        if loc not in self.sites:
+            self.sites[loc] = len(self.sites)
+
+        # all statistics are reduced on the device and stored without a host sync
+        val = 1 << (bitWidth-1)
+        scale = torch.pow(2.0, sf) if isinstance(sf, torch.Tensor) else pow(2.0, sf)
+        # only values clipped to the representable range count as saturated, as in cached_quantize
+        scaled = inputs * scale
+        saturation = ((scaled > (val-1) + 0.5) | (scaled < (-val) - 0.5)).float().mean()
+        underflow = ((quantized == 0) & (inputs != 0)).float().mean()
+        roundError = (quantized - inputs).abs().mean()
+        exponent = sf.float().mean() if isinstance(sf, torch.Tensor) else torch.tensor(float(sf), device=inputs.device)
+
+        device = inputs.device
+        if device not in self.buffers:
+            self.buffers[device] = [torch.zeros(self.capacity, len(self.COLUMNS), dtype=torch.float64, device=device), 0]
+        buffer = self.buffers[device]
+
+        row = buffer[0][buffer[1]]
+        row[0] = step
+        row[1] = self.sites[loc]
+        row[2] = bitWidth
+        row[3:].copy_(torch.stack((exponent, saturation, underflow, roundError)))
+        buffer[1] += 1
+
+        if buffer[1] == self.capacity:
+            self.flush(device)
+
+    def flush(self, device):
+        buffer, rows = self.buffers[device]
+        if rows == 0:
+            return
+
+        # the only transfer to the host, file I/O is left to the writer thread
+        # on the CPU .cpu() returns the ring buffer itself, the rows are copied before they are overwritten
+        self.queue.put((buffer[:rows].cpu().numpy().copy(), dict(self.sites)))
+        self.buffers[device][1] = 0
+
+    def write_chunks(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            rows, sites = item
+            chunkPath = os.path.join(self.path, 'chunk-{:05d}.npz'.format(self.chunk))
+            np.savez(chunkPath, **{col: rows[:, i] for i, col in enumerate(self.COLUMNS)})
+            with open(os.path.join(self.path, 'sites.json'), 'w') as f:
+                json.dump(sites, f)
+            self.chunk += 1
+
+    def close(self):
+        for device in self.buffers:
+            self.flush(device)
+        self.queue.put(None)
+        self.writer.join()
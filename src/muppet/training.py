@@ -8,6 +8,7 @@ import torch.autograd
 import src.utils as utils
 import src.training as trainingSrc
 import src.muppet.quantize as quantizerSrc
+import src.muppet.int_storage as int_storage
 
 class Trainer(trainingSrc.Trainer):
     def __init__(self, quantizer):
@@ -39,7 +40,9 @@ class Trainer(trainingSrc.Trainer):
 
     def train(self, model, criterion, optimiser, inputs, targets, params): 
 
-        outputs = model(inputs)
+        # saved activations are kept as integer mantissas while the network is quantized
+        with int_storage.pack_saved_activations(self.quantizer.intStorage and params.dataType != 'Float'):
+            outputs = model(inputs)
         
         if 'googlenet' in params.arch:
             if params.evaluate == False and params.dataset == 'imagenet':
@@ -59,64 +62,98 @@ class Trainer(trainingSrc.Trainer):
             loss = criterion(outputs, targets)
             prec1, prec5 = utils.accuracy(outputs.data, targets.data) 
 
-        model.zero_grad() 
+        # through the optimizer, which keeps flat gradient buffers in place
+        optimiser.zero_grad() 
         loss.backward() 
 
         optimiser.step(params)
 
-        return (loss.item(), prec1.item(), prec5.item())
+        # left on the device, the meters only synchronise when they are read
+        return (loss.detach(), prec1, prec5)
 
-    def batch_iter(self, model, criterion, optimiser, train_loader, params, losses, top1, top5):
+    def batch_iter(self, model, criterion, optimiser, train_loader, params, losses, top1, top5, policy=None):
         model.train()
         
-        for batch_idx, (inputs, targets) in tqdm(enumerate(train_loader), total=len(train_loader)-1, desc='epoch', leave=False): 
+        bar = utils.progress(enumerate(train_loader), params, total=len(train_loader)-1, desc='epoch', leave=False)
+        for batch_idx, (inputs, targets) in bar: 
             # move inputs and targets to GPU
             device = 'cuda:'+str(params.gpuList[0])
             if params.use_cuda: 
                 inputs, targets = inputs.cuda(device, non_blocking=True), targets.cuda(device, non_blocking=True)
             
-            if params.dataType != 'Float':
-                for i in range(len(inputs)):
-                    inputs[i], _ = self.quantizer.quantize_inputs(inputs[i].data, params.bitWidth, "inputs")
+            # quantize every sample at once, unless the DataLoader workers already did
+            if params.dataType != 'Float' and params.inputQuantization == 'Device':
+                inputs, _ = self.quantizer.quantize_batch(inputs, params.bitWidth, "inputs")
             
             # train model
             loss, prec1, prec5 = self.train(model, criterion, optimiser, inputs, targets, params)
+            self.quantizer.step()
+            if policy is not None and params.runMuppet:
+                policy.accumulate(model, batch_idx, optimiser)
 
             losses.update(loss) 
             top1.update(prec1) 
             top5.update(prec5)
+            utils.log_progress(bar, batch_idx, params, losses, top1, top5)
     
     def train_network(self, params, tbx_writer, checkpointer, train_loader, test_loader, valLoader, model, criterion, optimiser, inferer, policy, scaler):
         print('Epoch,\tLR,\tTrain_Loss,\tTrain_Top1,\tTrain_Top5,\tTest_Loss,\tTest_Top1,\tTest_Top5,\tVal_Loss,\tVal_Top1,\tVal_Top5,\tDataType,\tBitWidth')
         
+        # batchIdx restarts every epoch, a longer interval would never fold any gradients
+        if params.runMuppet and params.gdInterval > len(train_loader):
+            raise ValueError('GD_Accumulation_Interval ({}) exceeds the {} batches of an epoch'.format(params.gdInterval, len(train_loader)))
+
+        if params.inputQuantization == 'Loader' and not isinstance(train_loader.collate_fn, quantizerSrc.QuantizeCollate):
+            train_loader.collate_fn = quantizerSrc.QuantizeCollate(train_loader.collate_fn, self.quantizer.roundMeth, params.manual_seed, train_loader.num_workers)
+            train_loader.worker_init_fn = quantizerSrc.InputWorkerInit(train_loader.worker_init_fn)
+
         for epoch in tqdm(range(params.start_epoch, params.epochs), desc='training', leave=False) : 
             params.curr_epoch = epoch
             state = self.update_lr(params, optimiser)
+
+            # workers are started when the epoch begins and quantize at the precision of this epoch
+            if params.inputQuantization == 'Loader':
+                train_loader.collate_fn.bitWidth = params.bitWidth if params.dataType != 'Float' else -1
+                train_loader.collate_fn.epoch = epoch
     
             losses = utils.AverageMeter()
             top1 = utils.AverageMeter()
             top5 = utils.AverageMeter()
 
             # iterate over the batches in the epoch
-            self.batch_iter(model, criterion, optimiser, train_loader, params, losses, top1, top5)
+            self.batch_iter(model, criterion, optimiser, train_loader, params, losses, top1, top5, policy)
 
             params.train_loss = losses.avg        
             params.train_top1 = top1.avg        
             params.train_top5 = top5.avg        
+
+            if self.quantizer.cache is not None:
+                for role, (hitRate, satRate) in self.quantizer.cache.stats().items():
+                    tqdm.write("sf cache {}: hit rate = {:.4f}, saturation rate = {:.6f}".format(role, hitRate, satRate))
+                self.quantizer.cache.reset_stats()
             
             # get val and test loss
             params.test_loss, params.test_top1, params.test_top5 = inferer.test_network(params, test_loader, model, criterion, optimiser)
             params.val_loss, params.val_top1, params.val_top5 = inferer.test_network(params, valLoader, model, criterion, optimiser)
+            # the inference passes must not feed the refresh decisions and statistics of training
+            if self.quantizer.cache is not None:
+                self.quantizer.cache.discard()
             
             if params.runMuppet:
-                policy.update(model)
-                if policy.check_violation(epoch, tqdm, checkpointer):
+                policy.record_bit_width(scaler)
+                policy.update(model, optimiser)
+                policy.end_epoch(epoch)
+                if params.perLayerPrecision:
+                    if policy.check_layer_violations(epoch, tqdm, scaler, optimiser):
+                        tqdm.write("GD violation detected, layer precisions changed to {}".format(list(scaler.bit_widths().values())))
+                elif policy.check_violation(epoch, tqdm, checkpointer):
                     policy.change_precision(scaler, model, optimiser)
                     tqdm.write("GD violation detected, precision changed to {}".format(params.bitWidth))
                 if policy.check_stopping_condition(optimiser):
-                    tqdm.write("Ending training")
+                    tqdm.write("Ending training, average effective bit width = {:.2f}".format(params.runAvgBitWidth))
                     return
             
+            params.siteBitWidths = scaler.bit_widths()
             checkpointer.save_checkpoint(model.state_dict(), optimiser.state_dict(), params)
             
             tqdm.write("{},\t{},\t{:10.5f},\t{:10.5f},\t{:10.5f},\t{:10.5f},\t{:10.5f},\t{:10.5f},\t{:10.5f},\t{:10.5f},\t{:10.5f},\t{},\t\t{}".format(epoch, params.lr, params.train_loss, params.train_top1, params.train_top5, params.test_loss, params.test_top1, params.test_top5, params.val_loss, params.val_top1, params.val_top5, params.dataType, params.bitWidth))
@@ -8,6 +8,10 @@ class Params() :
         # attributes read in from config file 
         self.dataset = config_file.get('dataset', 'dataset')
         self.data_location = config_file.get('dataset', 'dataset_location')
+        self.cifarBackend = config_file.get('dataset', 'cifar_backend', fallback='Torchvision')
+        self.imagenetShards = config_file.get('dataset', 'imagenet_shards', fallback='')
+        self.shuffleBuffer = config_file.getint('dataset', 'shuffle_buffer', fallback=8192)
+        assert self.cifarBackend in ('Torchvision', 'Tensor', 'TensorGPU'), 'Cifar_Backend should be one of Torchvision, Tensor or TensorGPU'
 
         self.arch = config_file.get('cnn', 'architecture')        
         self.depth = config_file.getint('cnn', 'depth')       
@@ -25,9 +29,15 @@ class Params() :
         self.gamma = config_file.getfloat('training_hyperparameters', 'gamma')
         self.momentum = config_file.getfloat('training_hyperparameters', 'momentum') 
         self.weight_decay = config_file.getfloat('training_hyperparameters', 'weight_decay') 
+        self.optimizer = config_file.get('training_hyperparameters', 'optimizer', fallback='SGD')
+        self.betas = tuple(float(x) for x in config_file.get('training_hyperparameters', 'betas', fallback='0.9 0.999').split())
+        self.eps = config_file.getfloat('training_hyperparameters', 'eps', fallback=1e-8)
+        self.trustCoefficient = config_file.getfloat('training_hyperparameters', 'trust_coefficient', fallback=0.001)
         self.mo_schedule = [self.__to_num(i) for i in config_file.get('training_hyperparameters', 'momentum_schedule').split()]
         self.lr_schedule = [self.__to_num(i) for i in config_file.get('training_hyperparameters', 'lr_schedule').split()]
         self.trainValSplit = config_file.getfloat('training_hyperparameters', 'train_val_split')
+        self.logInterval = config_file.getint('training_hyperparameters', 'log_interval', fallback=0)
+        self.progressInterval = config_file.getfloat('training_hyperparameters', 'progress_interval', fallback=1.0)
         
         self.sub_classes = config_file.get('pruning_hyperparameters', 'sub_classes', fallback='').split() 
 
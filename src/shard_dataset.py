@@ -0,0 +1,189 @@
+import io
+import os
+import copy
+import json
+import random
+import struct
+
+import torch
+import torch.utils.data
+import torchvision.datasets
+
+import numpy as np
+from PIL import Image
+
+# every record is the label and the byte length of the encoded image that follows it
+HEADER = struct.Struct('<iI')
+MANIFEST = 'index.json'
+LABELS = 'labels.npy'
+ORDER = 'order.npy'
+
+def encode(path, shortSide, quality):
+    # decoded once, resized so that the short side is at most shortSide and encoded back to JPEG
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+        w, h = img.size
+        scale = shortSide / min(w, h)
+        if scale < 1:
+            img = img.resize((round(w*scale), round(h*scale)), Image.BILINEAR)
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', quality=quality)
+        return buf.getvalue()
+
+def write_shard(job):
+    path, samples, shortSide, quality = job
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        for imgPath, label in samples:
+            data = encode(imgPath, shortSide, quality)
+            f.write(HEADER.pack(label, len(data)))
+            f.write(data)
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+def convert(folder, outDir, shortSide=256, samplesPerShard=4096, quality=90, workers=8, seed=0, log=print):
+    # writes an ImageFolder as sequential shards of pre-resized images, in a global random order so that every shard
+    # mixes all classes, order.npy holds the ImageFolder index of every record so that the split index files
+    # of the folder still apply to the shards
+    import multiprocessing
+
+    dataset = torchvision.datasets.ImageFolder(folder)
+    os.makedirs(outDir, exist_ok=True)
+    order = np.random.RandomState(seed).permutation(len(dataset.samples)).astype(np.int32)
+
+    shards = []
+    jobs = []
+    for i, start in enumerate(range(0, len(order), samplesPerShard)):
+        samples = [dataset.samples[j] for j in order[start:start+samplesPerShard]]
+        name = 'shard_{:05d}.bin'.format(i)
+        shards.append({'file': name, 'start': start, 'count': len(samples)})
+        jobs.append((os.path.join(outDir, name), samples, shortSide, quality))
+
+    with multiprocessing.Pool(workers) as pool:
+        for i, size in enumerate(pool.imap(write_shard, jobs)):
+            shards[i]['bytes'] = size
+            log('{}: {} images, {:.1f} MB'.format(shards[i]['file'], shards[i]['count'], size / 2**20))
+
+    np.save(os.path.join(outDir, ORDER), order)
+    np.save(os.path.join(outDir, LABELS), np.asarray(dataset.targets, dtype=np.int32))
+    # the manifest is written last and marks a complete conversion
+    with open(os.path.join(outDir, MANIFEST), 'w') as f:
+        json.dump({'classes': dataset.classes, 'shortSide': shortSide, 'shards': shards}, f)
+
+class ShardStream(torch.utils.data.IterableDataset):
+    # streams the samples of a converted ImageFolder as batches, reading whole shards with one sequential read each
+    # every loader worker reads a fixed share of the shards, in an order shuffled every epoch, and shuffles
+    # its samples within a buffer of shuffleBuffer encoded images
+    def __init__(self, root, transform=None, shuffleBuffer=8192):
+        self.root = root
+        self.transform = transform
+        self.shuffleBuffer = shuffleBuffer
+        self.batchSize = None
+        self.numWorkers = 1
+        with open(os.path.join(root, MANIFEST), 'r') as f:
+            self.manifest = json.load(f)
+        self.classes = self.manifest['classes']
+        # labels are in ImageFolder order, order maps the records of the shards to ImageFolder indices
+        self.targets = np.load(os.path.join(root, LABELS), mmap_mode='r')
+        self.order = np.load(os.path.join(root, ORDER), mmap_mode='r')
+        self.select(None)
+
+    def select(self, indices):
+        # only the samples at the given ImageFolder indices are streamed
+        if indices is None:
+            self.selected = None
+            shardCounts = [shard['count'] for shard in self.manifest['shards']]
+        else:
+            self.selected = np.zeros(len(self.targets), dtype=bool)
+            self.selected[np.asarray(indices)] = True
+            inOrder = self.selected[self.order]
+            shardCounts = [int(inOrder[shard['start']:shard['start']+shard['count']].sum()) for shard in self.manifest['shards']]
+        self.shardCounts = shardCounts
+        self.numSamples = sum(shardCounts)
+
+    def subset(self, indices):
+        stream = copy.copy(self)
+        stream.select(indices)
+        return stream
+
+    def worker_shards(self, workerId, numWorkers):
+        return list(range(workerId, len(self.manifest['shards']), numWorkers))
+
+    def __len__(self):
+        # batches, every worker ends with its own partial batch
+        if self.batchSize is None:
+            return self.numSamples
+        batches = 0
+        for workerId in range(self.numWorkers):
+            count = sum(self.shardCounts[i] for i in self.worker_shards(workerId, self.numWorkers))
+            batches += (count + self.batchSize - 1) // self.batchSize
+        return batches
+
+    def read_shard(self, shard):
+        with open(os.path.join(self.root, shard['file']), 'rb') as f:
+            data = f.read()
+
+        # the encoded images are copied out, so that the shuffle buffer does not keep whole shards alive
+        offset = 0
+        for idx in self.order[shard['start']:shard['start']+shard['count']]:
+            label, length = HEADER.unpack_from(data, offset)
+            offset += HEADER.size
+            if self.selected is None or self.selected[idx]:
+                yield data[offset:offset+length], label
+            offset += length
+
+    def decode(self, sample):
+        data, label = sample
+        img = Image.open(io.BytesIO(data)).convert('RGB')
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, label
+
+    def samples(self):
+        info = torch.utils.data.get_worker_info()
+        if info is None:
+            workerId, numWorkers = 0, 1
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+        else:
+            workerId, numWorkers = info.id, info.num_workers
+            seed = info.seed
+        rng = random.Random(seed)
+
+        shards = self.worker_shards(workerId, numWorkers)
+        rng.shuffle(shards)
+
+        buffer = []
+        for shard in shards:
+            for sample in self.read_shard(self.manifest['shards'][shard]):
+                if len(buffer) < self.shuffleBuffer:
+                    buffer.append(sample)
+                    continue
+                j = rng.randrange(len(buffer))
+                yield self.decode(buffer[j])
+                buffer[j] = sample
+
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self.decode(sample)
+
+    def __iter__(self):
+        if self.batchSize is None:
+            for sample in self.samples():
+                yield sample
+            return
+
+        batch = []
+        for sample in self.samples():
+            batch.append(sample)
+            if len(batch) == self.batchSize:
+                yield torch.utils.data.dataloader.default_collate(batch)
+                batch = []
+        if batch != []:
+            yield torch.utils.data.dataloader.default_collate(batch)
+
+    def loader(self, indices, batchSize, workers):
+        # the stream batches itself so that the loader length accounts for the partial last batch of every worker
+        stream = self.subset(indices)
+        stream.batchSize = batchSize
+        stream.numWorkers = max(workers, 1)
+        return torch.utils.data.DataLoader(stream, batch_size=None, num_workers=workers, pin_memory=torch.cuda.is_available())
@@ -0,0 +1,94 @@
+import os
+import csv
+import json
+
+import numpy as np
+
+# sample indices are kept as int32 arrays, which can be saved and memory mapped as they are
+INDEX_DTYPE = np.int32
+
+def class_buckets(labels, indices=None):
+    # classes present among indices and, for each of them, its indices in their original order,
+    # from one stable argsort instead of a pass over the labels per class
+    labels = np.asarray(labels)
+    indices = np.arange(len(labels), dtype=INDEX_DTYPE) if indices is None else np.asarray(indices, dtype=INDEX_DTYPE)
+    order = np.argsort(labels[indices], kind='stable')
+    classes, counts = np.unique(labels[indices[order]], return_counts=True)
+    return classes, np.split(indices[order], np.cumsum(counts)[:-1])
+
+def subset(labels, classes):
+    # indices, in sample order, of the samples whose label is one of classes, using a bitmap over the label values
+    labels = np.asarray(labels)
+    classes = np.asarray(classes, dtype=np.int64)
+    if len(classes) == 0 or len(labels) == 0:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+
+    bitmap = np.zeros(max(int(labels.max()), int(classes.max())) + 1, dtype=bool)
+    bitmap[classes] = True
+    return np.flatnonzero(bitmap[labels]).astype(INDEX_DTYPE)
+
+def stratified_split(labels, indices, trainFraction):
+    # the first trainFraction of the indices of every class go to the training split and the rest to validation,
+    # positions within each class come from the sorted class starts rather than a per class loop
+    labels = np.asarray(labels)
+    indices = np.asarray(indices, dtype=INDEX_DTYPE)
+    order = np.argsort(labels[indices], kind='stable')
+    sortedIndices = indices[order]
+
+    _, starts, counts = np.unique(labels[sortedIndices], return_index=True, return_counts=True)
+    rank = np.arange(len(sortedIndices)) - np.repeat(starts, counts)
+    inTrain = rank < np.repeat((counts * trainFraction).astype(np.int64), counts)
+    return sortedIndices[inTrain], sortedIndices[~inTrain]
+
+def binary_path(path):
+    # binary split index stored next to the CSV or JSON file it replaces
+    return os.path.splitext(path)[0] + '.npy'
+
+def save_indices(path, indices):
+    # written under a temporary name first so that a concurrent launch never maps a partial file
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, np.asarray(indices, dtype=INDEX_DTYPE))
+    os.replace(tmp, path)
+
+def load_indices(path):
+    # split indices memory mapped from the .npy next to the CSV at path, the single row CSV is converted on first use
+    npyPath = binary_path(path)
+    if not os.path.isfile(npyPath):
+        print('Converting {} to {}'.format(path, npyPath))
+        with open(path, 'r') as csvFile:
+            row = next(csv.reader(csvFile, delimiter=','))
+        save_indices(npyPath, np.array(row).astype(INDEX_DTYPE))
+    return np.load(npyPath, mmap_mode='r')
+
+def save_class_indices(path, buckets):
+    # per class indices as one .npy of all the buckets back to back, with the class name to [start, end) map
+    # in a small JSON written last, whose presence marks a complete index
+    names = list(buckets.keys())
+    lengths = [len(buckets[name]) for name in names]
+    ends = np.cumsum(lengths).tolist()
+    starts = [0] + ends[:-1]
+    save_indices(binary_path(path), np.concatenate([np.asarray(buckets[name], dtype=INDEX_DTYPE) for name in names]) if names else [])
+
+    mapPath = os.path.splitext(path)[0] + '_classes.json'
+    with open(mapPath + '.tmp', 'w') as mapFile:
+        json.dump({name: [start, end] for name, start, end in zip(names, starts, ends)}, mapFile)
+    os.replace(mapPath + '.tmp', mapPath)
+
+def has_class_indices(path):
+    return os.path.isfile(os.path.splitext(path)[0] + '_classes.json') or os.path.isfile(path)
+
+def load_class_indices(path, classes):
+    # indices of the given classes gathered from the memory mapped per class index, the JSON at path is converted on first use
+    mapPath = os.path.splitext(path)[0] + '_classes.json'
+    if not os.path.isfile(mapPath):
+        print('Converting {} to {}'.format(path, binary_path(path)))
+        with open(path, 'r') as jsonFile:
+            save_class_indices(path, json.load(jsonFile))
+
+    with open(mapPath, 'r') as mapFile:
+        ranges = json.load(mapFile)
+    indices = np.load(binary_path(path), mmap_mode='r')
+    if len(classes) == 0:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    return np.concatenate([indices[ranges[c][0]:ranges[c][1]] for c in classes])
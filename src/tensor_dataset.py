@@ -0,0 +1,62 @@
+import torch
+import torch.utils.data
+import torch.nn.functional as F
+
+import numpy as np
+
+CIFAR_MEAN = (0.4914, 0.4822, 0.4465)
+CIFAR_STD = (0.2023, 0.1994, 0.2010)
+
+class CIFARTensorSet(torch.utils.data.Dataset):
+    # whole CIFAR split held as one uint8 NCHW tensor, indexed with a list of indices per batch
+    # so that random crop, flip and normalisation run as a few vectorised ops over the batch
+    def __init__(self, X, labels, augment, device='cpu', mean=CIFAR_MEAN, std=CIFAR_STD, padding=4):
+        # rows of the pickled batches are the channel planes of the image one after the other
+        self.images = torch.from_numpy(np.ascontiguousarray(X, dtype=np.uint8)).view(-1, 3, 32, 32).to(device)
+        self.targets = torch.as_tensor(np.asarray(labels), dtype=torch.long).to(device)
+        self.augment = augment
+        self.padding = padding
+
+        # ToTensor and Normalize folded into one multiply and subtract
+        std = torch.tensor(std, device=device).view(1, 3, 1, 1)
+        self.scale = 1.0 / (255.0 * std)
+        self.shift = torch.tensor(mean, device=device).view(1, 3, 1, 1) / std
+
+    def __len__(self):
+        return self.images.size(0)
+
+    def __getitem__(self, indices):
+        idx = torch.as_tensor(indices, dtype=torch.long, device=self.images.device)
+        images = self.images[idx]
+        if self.augment:
+            images = self.crop_flip(images)
+        return images.float().mul_(self.scale).sub_(self.shift), self.targets[idx]
+
+    def crop_flip(self, images):
+        # RandomCrop(32, padding) and RandomHorizontalFlip with a crop offset and a flip drawn per image,
+        # gathered from the zero padded batch in a single indexing op
+        n, c, h, w = images.size()
+        device = images.device
+        padded = F.pad(images, (self.padding,) * 4)
+
+        rows = torch.randint(0, 2*self.padding+1, (n, 1), device=device) + torch.arange(h, device=device)
+        cols = torch.randint(0, 2*self.padding+1, (n, 1), device=device) + torch.arange(w, device=device)
+        flip = torch.rand(n, 1, device=device) < 0.5
+        cols = torch.where(flip, cols.flip(1), cols)
+
+        batch = torch.arange(n, device=device).view(n, 1, 1, 1)
+        channel = torch.arange(c, device=device).view(1, c, 1, 1)
+        return padded[batch, channel, rows.view(n, 1, h, 1), cols.view(n, 1, 1, w)]
+
+    def loader(self, indices, batchSize, workers):
+        # the sampler yields index lists and the dataset builds whole batches, each loader batch of size one holds
+        # one of them and is unwrapped by the collate function (batch_size=None needs torch 1.2 or later)
+        # batches on the device are built in the main process, host batches in at most one worker
+        sampler = torch.utils.data.sampler.BatchSampler(torch.utils.data.sampler.SubsetRandomSampler(indices), batchSize, drop_last=False)
+        onDevice = self.images.is_cuda
+        return torch.utils.data.DataLoader(self, batch_size=1, sampler=sampler, collate_fn=unwrap_batch, num_workers=0 if onDevice else min(workers, 1), \
+                                           pin_memory=torch.cuda.is_available() and not onDevice)
+
+def unwrap_batch(batch):
+    # module level so that it can be sent to the loader workers
+    return batch[0]
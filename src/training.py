@@ -48,7 +48,8 @@ class Trainer(object):
     def batch_iter(self, model, criterion, optimiser, train_loader, params, losses, top1, top5):
     #{{{
         model.train()
-        for batch_idx, (inputs, targets) in tqdm(enumerate(train_loader), total=len(train_loader)-1, desc='epoch', leave=False): 
+        bar = utils.progress(enumerate(train_loader), params, total=len(train_loader)-1, desc='epoch', leave=False)
+        for batch_idx, (inputs, targets) in bar: 
             # move inputs and targets to GPU
             if params.use_cuda : 
                 inputs, targets = inputs.cuda(), targets.cuda()
@@ -61,6 +62,7 @@ class Trainer(object):
             losses.update(loss) 
             top1.update(prec1) 
             top5.update(prec5)
+            utils.log_progress(bar, batch_idx, params, losses, top1, top5)
     #}}}
     
     def train_network(self, params, tbx_writer, checkpointer, train_loader, valLoader, test_loader, model, criterion, optimiser, inferer):  
@@ -1,5 +1,8 @@
 import sys
 
+import torch
+from tqdm import tqdm
+
 class AverageMeter(object):
     """Computes and stores the average and current value
        Imported from https://github.com/pytorch/examples/blob/master/imagenet/main.py#L247-L262
@@ -9,15 +12,23 @@ class AverageMeter(object):
 
     def reset(self):
         self.val = 0
-        self.avg = 0
         self.sum = 0
         self.count = 0
 
     def update(self, val, n=1):
+        # tensors are summed on their device, reading avg is the only point that synchronises
+        if isinstance(val, torch.Tensor):
+            val = val.detach()
         self.val = val
         self.sum += val * n
         self.count += n
-        self.avg = self.sum / self.count
+
+    @property
+    def avg(self):
+        if self.count == 0:
+            return 0
+        avg = self.sum / self.count
+        return avg.item() if isinstance(avg, torch.Tensor) else avg
 
 class TeePrinting(object): 
     def __init__(self, logfile=None): 
@@ -50,3 +61,12 @@ def accuracy(output, target) :
         res.append(correct_k.mul_(100.0 / batch_size))
 
     return res
+
+def progress(iterable, params, **kwargs):
+    # tqdm bar that redraws at most every Progress_Interval seconds
+    return tqdm(iterable, mininterval=params.progressInterval, **kwargs)
+
+def log_progress(bar, batchIdx, params, losses, top1, top5):
+    # the running averages are read, and the device synchronised, only every Log_Interval batches
+    if params.logInterval > 0 and (batchIdx + 1) % params.logInterval == 0:
+        bar.set_postfix(loss=losses.avg, top1=top1.avg, top5=top5.avg, refresh=False)